@@ -0,0 +1,120 @@
+"use strict";
+{
+  // number of parts of a multipart upload sent at once
+  const PARALLEL_PARTS = 4;
+
+  function csrfToken(form) {
+    return form.querySelector("input[name=csrfmiddlewaretoken]").value;
+  }
+
+  async function postJson(url, form, data) {
+    let response = await fetch(url, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "X-CSRFToken": csrfToken(form),
+      },
+      body: JSON.stringify(data),
+    });
+    let result = await response.json();
+    if (!response.ok) {
+      throw new Error(result.error);
+    }
+    return result;
+  }
+
+  async function send(target, body) {
+    let response = await fetch(target.url, {
+      method: target.method,
+      headers: target.headers,
+      body: body,
+    });
+    if (!response.ok) {
+      throw new Error(`Upload failed (${response.status}).`);
+    }
+    // S3 must expose the ETag header to CORS requests
+    return response.headers.get("ETag");
+  }
+
+  async function sendParts(upload, file) {
+    let etags = new Array(upload.parts.length);
+    let next = 0;
+    async function worker() {
+      while (next < upload.parts.length) {
+        let part = next++;
+        let start = part * upload.part_size;
+        etags[part] = await send(
+          upload.parts[part],
+          file.slice(start, start + upload.part_size)
+        );
+      }
+    }
+    let workers = [];
+    for (let i = 0; i < PARALLEL_PARTS; i++) {
+      workers.push(worker());
+    }
+    await Promise.all(workers);
+    return etags;
+  }
+
+  async function upload(input) {
+    let file = input.files[0];
+    let form = input.form;
+    let tokenInput = form.querySelector(
+      `input[type=hidden][name="${input.dataset.name}"]`
+    );
+    tokenInput.value = "";
+    if (!file) {
+      return;
+    }
+    let buttons = form.querySelectorAll("button[type=submit]");
+    buttons.forEach((button) => (button.disabled = true));
+    try {
+      let upload = await postJson(input.dataset.directUpload, form, {
+        filename: file.name,
+        size: file.size,
+        content_type: file.type,
+      });
+      if (upload.target) {
+        await send(upload.target, file);
+      } else {
+        let etags = await sendParts(upload, file);
+        await postJson(input.dataset.directUploadComplete, form, {
+          token: upload.token,
+          etags: etags,
+        });
+      }
+      tokenInput.value = upload.token;
+    } catch (error) {
+      input.value = "";
+      M.toast({ html: error.message });
+    } finally {
+      buttons.forEach((button) => (button.disabled = false));
+    }
+  }
+
+  function init() {
+    document
+      .querySelectorAll("input[type=file][data-direct-upload]")
+      .forEach((input) => {
+        if (input.dataset.name) {
+          return;
+        }
+        // post the upload token in place of the file
+        let tokenInput = document.createElement("input");
+        tokenInput.type = "hidden";
+        tokenInput.name = input.name;
+        input.dataset.name = input.name;
+        input.removeAttribute("name");
+        input.after(tokenInput);
+        input.addEventListener("change", () => upload(input));
+      });
+  }
+
+  if (document.readyState === "complete") {
+    init();
+  } else {
+    document.addEventListener("turbolinks:load", init, { once: true });
+  }
+  document.addEventListener("turbolinks:render", init);
+}
@@ -1,7 +1,7 @@
 from django.urls import include, path
 from django.views.generic.base import RedirectView
 
-from .views import question, user, vote
+from .views import question, upload, user, vote
 
 urlpatterns = [
     path('', RedirectView.as_view(url='user/', permanent=True), name='index'),
@@ -15,4 +15,8 @@ urlpatterns = [
 
     path('question/', include(question.QuestionViewSet().urls)),
     path('vote/', include(vote.VoteViewSet().urls)),
+
+    path('upload/', upload.UploadStartView.as_view(), name='upload'),
+    path('upload/complete/', upload.UploadCompleteView.as_view(),
+         name='upload_complete'),
 ]
@@ -15,17 +15,23 @@ from material.frontend.views import (CreateModelView, DetailModelView,
                                      UpdateModelView)
 from modeltranslation.utils import get_translation_fields
 from polls.models import Attachment, Choice, Question, QuestionFollower, User
+from polls.services import top_custom_choices, with_live_total_vote_count
+from polls.storage import file_urls
 
-from ...utils.forms import (FieldDataMixin, GetParamAsFormDataMixin,
-                            NestedModelFormField)
-from ...utils.views import (ActionChoices, ActionHandler, DeletedListMixin,
-                            DeletedListModelView, ListActionMixin,
-                            ListFilterView, SearchAndFilterSet)
+from ...utils.forms import (DirectUploadField, FieldDataMixin,
+                            GetParamAsFormDataMixin, NestedModelFormField)
+from ...utils.views import (ActionChoices, ActionHandler, BatchedColumnsMixin,
+                            DeletedListMixin, DeletedListModelView,
+                            ListActionMixin, ListFilterView,
+                            SearchAndFilterSet)
 
 
 class AttachmentsForm(ModelForm):
-    file = FileField(label="Attachment",
-                     max_length=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    if settings.DIRECT_UPLOADS:
+        file = DirectUploadField(label="Attachment")
+    else:
+        file = FileField(label="Attachment",
+                         max_length=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
 
     layout = Layout('file')
     parent_instance_field = 'question'
@@ -103,8 +109,12 @@ class MaxVoteCountForm(ModelForm, FieldDataMixin):
 
 
 class QuestionForm(SuperModelForm, FieldDataMixin):
-    thumbnail = ImageField(required=False, label='Thumbnail',
-                           max_length=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    if settings.DIRECT_UPLOADS:
+        thumbnail = DirectUploadField(image=True, required=False,
+                                      label='Thumbnail')
+    else:
+        thumbnail = ImageField(required=False, label='Thumbnail',
+                               max_length=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
     max_vote_count_control = NestedModelFormField(MaxVoteCountForm)
 
     # Formset fields
@@ -334,18 +344,34 @@ class QuestionActionHandler(ActionHandler):
             total_vote_count=F('total_vote_count')+1)
 
 
-class QuestionListView(ListActionMixin, ListModelView, ListFilterView):
+class QuestionListView(BatchedColumnsMixin, ListActionMixin, ListModelView,
+                       ListFilterView):
     list_display = [
         'question_text', 'creator', 'choice_list', 'show_vote',
-        'pub_date', 'total_vote_count'
+        'pub_date', 'live_total_vote_count'
     ]
+    batched_columns = {'choice_list': Question.choice_lists}
     filterset_class = QuestionFilter
     action_choices = QuestionActionChoices
     action_handler = QuestionActionHandler
 
+    def get_queryset(self):
+        # include votes not yet rolled up from counter shards
+        queryset = with_live_total_vote_count(super().get_queryset())
+        return queryset.select_related('creator__account')
 
-class QuestionDeletedListView(DeletedListModelView):
+    def live_total_vote_count(self, obj):
+        return obj.live_total_vote_count
+    live_total_vote_count.short_description = 'total vote count'
+    live_total_vote_count.order_field = 'total_vote_count'
+
+
+class QuestionDeletedListView(BatchedColumnsMixin, DeletedListModelView):
     list_display = ['question_text', 'creator', 'choice_list']
+    batched_columns = {'choice_list': Question.choice_lists}
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('creator__account')
 
 
 class QuestionDetailView(DetailModelView):
@@ -356,10 +382,13 @@ class QuestionDetailView(DetailModelView):
         for item in super().get_object_data():
             if item[0] == thumbnail_name:
                 if item[1]:
+                    srcset = question.thumbnail_srcset()
                     ctx = {'attrs': {
                         'class': 'thumbnail',
                         'src': item[1].url,
-                        'alt': item[1].name
+                        'alt': item[1].name,
+                        'srcset': srcset or False,
+                        'sizes': '48px' if srcset else False,
                     }}
                     image_html = render_to_string('data/img.html', ctx)
                     yield (item[0], image_html)
@@ -370,12 +399,13 @@ class QuestionDetailView(DetailModelView):
 
         attachments = question.attachment_set.all()
         attachment_links = []
-        for attachment in attachments:
+        urls = file_urls(attachment.file for attachment in attachments)
+        for attachment, url in zip(attachments, urls):
             ctx = {
-                'content': attachment.file.name,
+                'content': attachment.filename,
                 'attrs': {
-                    'href': attachment.file.url,
-                    'download': True
+                    'href': url,
+                    'download': attachment.filename or True
                 },
             }
             attachment_links.append(render_to_string('data/a.html', ctx))
@@ -383,6 +413,16 @@ class QuestionDetailView(DetailModelView):
         html_list = render_to_string('data/ul.html', ctx)
         yield ('Attachments', html_list)
 
+        if question.allow_custom:
+            custom_choices = [
+                '%(text)s (%(count)s)' % {
+                    'text': custom_choice.text,
+                    'count': custom_choice.vote_count}
+                for custom_choice in top_custom_choices(question)]
+            ctx = {'items': custom_choices}
+            html_list = render_to_string('data/ul.html', ctx)
+            yield ('Top custom choices', html_list)
+
 
 class QuestionViewSet(ModelViewSet, DeletedListMixin):
     model = Question
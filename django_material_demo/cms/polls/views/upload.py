@@ -0,0 +1,46 @@
+import json
+
+from django.contrib.auth.mixins import (LoginRequiredMixin,
+                                        PermissionRequiredMixin)
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.http import JsonResponse
+from django.views import View
+from polls.uploads import complete_upload, start_upload
+
+
+class UploadView(LoginRequiredMixin, PermissionRequiredMixin, View):
+    # uploads are attached to questions being added or changed
+    permission_required = ['polls.add_question', 'polls.change_question']
+
+    def has_permission(self):
+        return any(self.request.user.has_perm(permission)
+                   for permission in self.get_permission_required())
+
+    def post(self, request):
+        try:
+            data = json.loads(request.body)
+            return JsonResponse(self.upload(data))
+        except (ValueError, TypeError, KeyError):
+            return JsonResponse({'error': 'Malformed upload request.'},
+                                status=400)
+        except ValidationError as e:
+            return JsonResponse({'error': e.messages[0]}, status=400)
+
+
+class UploadStartView(UploadView):
+    """Return the upload token and targets of a file to upload."""
+
+    def upload(self, data):
+        return start_upload(
+            default_storage, str(data['filename']), int(data['size']),
+            str(data.get('content_type') or 'application/octet-stream'))
+
+
+class UploadCompleteView(UploadView):
+    """Join the parts of a multipart upload."""
+
+    def upload(self, data):
+        etags = [str(etag) for etag in data['etags']]
+        complete_upload(default_storage, str(data['token']), etags)
+        return {'token': data['token']}
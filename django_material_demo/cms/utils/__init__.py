@@ -1,9 +1,10 @@
-from .forms import (FieldDataMixin, GetParamAsFormDataMixin,
-                    NestedModelFormField, RangeInput)
+from .forms import (DirectUploadField, FieldDataMixin,
+                    GetParamAsFormDataMixin, NestedModelFormField, RangeInput)
 from .modules import ModuleNamespaceMixin
 from .views import ListFilterView, SearchAndFilterSet
 
 __all__ = (
+    'DirectUploadField',
     'FieldDataMixin',
     'GetParamAsFormDataMixin',
     'NestedModelFormField',
@@ -1,9 +1,12 @@
 from django.core.exceptions import ValidationError
-from django.forms import widgets
+from django.core.files.storage import default_storage
+from django.forms import FileField, widgets
+from django.urls import reverse
 from django.views.generic.detail import SingleObjectTemplateResponseMixin
 from django.views.generic.edit import (ModelFormMixin, ProcessFormView,
                                        UpdateView)
 from django_superform import ModelFormField
+from polls.uploads import UPLOAD_NAME_MAX_LENGTH, uploaded_name
 
 
 class NestedModelFormField(ModelFormField):
@@ -20,6 +23,60 @@ class RangeInput(widgets.Input):
         js = ['js/range_input.js']
 
 
+class DirectUploadInput(widgets.ClearableFileInput):
+    """
+    File input whose file is uploaded straight to the file storage by
+    `js/direct_upload.js`, which then posts the upload token under the
+    input's name instead of the file.
+    """
+
+    class Media:
+        js = ['js/direct_upload.js']
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['attrs'].update({
+            'data-direct-upload': reverse('polls:upload'),
+            'data-direct-upload-complete': reverse('polls:upload_complete'),
+        })
+        return context
+
+    def value_from_datadict(self, data, files, name):
+        token = data.get(name)
+        clear = widgets.CheckboxInput().value_from_datadict(
+            data, files, self.clear_checkbox_name(name))
+        if clear and not self.is_required:
+            return widgets.FILE_INPUT_CONTRADICTION if token else False
+        return token
+
+    def value_omitted_from_data(self, data, files, name):
+        return (name not in data
+                and self.clear_checkbox_name(name) not in data)
+
+
+class DirectUploadField(FileField):
+    """
+    FileField taking the token of a file uploaded with `DirectUploadInput`,
+    cleaned to the name of the uploaded file.
+    """
+    widget = DirectUploadInput
+
+    def __init__(self, *, image=False, max_length=UPLOAD_NAME_MAX_LENGTH,
+                 **kwargs):
+        self.image = image
+        super().__init__(max_length=max_length, **kwargs)
+
+    def to_python(self, data):
+        if data in self.empty_values:
+            return None
+        name = uploaded_name(default_storage, data, image=self.image)
+        if self.max_length is not None and len(name) > self.max_length:
+            raise ValidationError(
+                self.error_messages['max_length'], code='max_length',
+                params={'max': self.max_length, 'length': len(name)})
+        return name
+
+
 class GetParamAsFormDataMixin(SingleObjectTemplateResponseMixin,
                               ModelFormMixin, ProcessFormView):
     # mixin to be used with CreateView or UpdateView
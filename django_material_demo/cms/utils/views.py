@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from functools import reduce
 from operator import or_
 
@@ -139,6 +140,34 @@ class ListActionMixin(object):
         return super().post(request, *args, **kwargs)
 
 
+class BatchedColumnsMixin(object):
+    """
+    Mixin to be used with ListModelView, resolving the columns in
+    `batched_columns` for a whole page at once instead of once per row.
+
+    Each column maps to a callable taking the objects of the page and
+    returning their values by pk.
+    """
+    batched_columns = {}
+
+    def get_table_data(self, start, length):
+        items = list(self.object_list[start:start + length])
+        list_display = self.get_list_display()
+        batched = {field_name: get_values(items)
+                   for field_name, get_values in self.batched_columns.items()
+                   if field_name in list_display}
+        for item in items:
+            columns = OrderedDict()
+            for field_name in list_display:
+                if field_name in batched:
+                    value = batched[field_name].get(item.pk)
+                else:
+                    value = self.get_data_attr(field_name).get_value(item)
+                columns[field_name] = self.format_column(
+                    item, field_name, value)
+            yield item, columns
+
+
 class DeletedListActionChoices(ActionChoices):
     RESTORE = 'restore'
 
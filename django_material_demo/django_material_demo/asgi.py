@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_material_demo.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported once the apps are loaded
+from polls.streams import ResultsStreamRouter  # noqa: E402
+
+# serves the live results stream without tying up a thread per client
+application = ResultsStreamRouter(django_application)
@@ -127,6 +127,23 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# A shared backend (e.g. memcached or Redis) is required whenever more than
+# one process serves the site, as with several ASGI workers or replicas:
+# cache invalidations only reach the processes sharing the cache, and with
+# the default per-process LocMemCache the others serve stale pages.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -178,12 +195,42 @@ MEDIA_URL = 'media/'
 
 FILE_STORAGE_IMPL = str(os.getenv('FILE_STORAGE_IMPL'))
 
+# Store each distinct file content once, see polls.models.Blob. Blobs no
+# longer referred to are deleted by `manage.py sweep_blobs`.
+CONTENT_ADDRESSED_STORAGE = (
+    str(os.getenv('CONTENT_ADDRESSED_STORAGE')).lower()
+    in ['true', 'yes', '1'])
+
 if FILE_STORAGE_IMPL.lower() == 's3':
-    DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+    # S3Boto3Storage keeping presigned URLs in the cache
+    DEFAULT_FILE_STORAGE = ('polls.storage.ContentAddressedS3Storage'
+                            if CONTENT_ADDRESSED_STORAGE
+                            else 'polls.storage.S3Storage')
 else:
-    # use django.core.files.storage.FileSystemStorage
-    # as defined in django/conf/global_settings.py
-    pass
+    # FileSystemStorage taking direct uploads through the polls app
+    DEFAULT_FILE_STORAGE = (
+        'polls.storage.ContentAddressedFileSystemStorage'
+        if CONTENT_ADDRESSED_STORAGE
+        else 'polls.storage.FileSystemUploadStorage')
+
+if CONTENT_ADDRESSED_STORAGE:
+    # hash uploaded files as they are received
+    FILE_UPLOAD_HANDLERS = [
+        'polls.uploads.HashingMemoryFileUploadHandler',
+        'polls.uploads.HashingTemporaryFileUploadHandler',
+    ]
+
+# Upload attachments and thumbnails from the browser straight to the file
+# storage instead of through the CMS forms. Files larger than
+# DIRECT_UPLOAD_PART_SIZE bytes are uploaded in parts of that size, in
+# parallel; upload targets expire after DIRECT_UPLOAD_EXPIRE seconds.
+DIRECT_UPLOADS = (str(os.getenv('DIRECT_UPLOADS')).lower()
+                  in ['true', 'yes', '1'])
+DIRECT_UPLOAD_MAX_SIZE = int(
+    os.getenv('DIRECT_UPLOAD_MAX_SIZE') or 1024 * 1024 * 1024)
+DIRECT_UPLOAD_PART_SIZE = int(
+    os.getenv('DIRECT_UPLOAD_PART_SIZE') or 8 * 1024 * 1024)
+DIRECT_UPLOAD_EXPIRE = int(os.getenv('DIRECT_UPLOAD_EXPIRE') or 900)
 
 # Amazon S3 settings
 # https://django-storages.readthedocs.io/en/latest/backends/amazon-S3.html
@@ -195,6 +242,86 @@ AWS_S3_SECRET_ACCESS_KEY = str(os.getenv('AWS_S3_SECRET_ACCESS_KEY'))
 AWS_S3_FILE_OVERWRITE = (str(os.getenv('AWS_S3_FILE_OVERWRITE')).lower()
                          in ['true', 'yes', '1'])
 AWS_LOCATION = str(os.getenv('AWS_LOCATION'))
+# Seconds presigned URLs stay valid
+AWS_QUERYSTRING_EXPIRE = int(os.getenv('AWS_QUERYSTRING_EXPIRE') or 7200)
+
+# Presigned file URLs are cached until FILE_URL_CACHE_MARGIN seconds before
+# they expire, other file URLs for FILE_URL_CACHE_TIMEOUT seconds. Cached
+# pages keep the URLs they were rendered with, so POLLS_PAGE_CACHE_TIMEOUT
+# should not exceed the margin.
+FILE_URL_CACHE_MARGIN = int(os.getenv('FILE_URL_CACHE_MARGIN') or 3600)
+FILE_URL_CACHE_TIMEOUT = int(os.getenv('FILE_URL_CACHE_TIMEOUT') or 86400)
+
+# File downloads are streamed FILE_DOWNLOAD_CHUNK_SIZE bytes at a time, or
+# handed off to the front server with FILE_DOWNLOAD_SENDFILE set to
+# `x-accel-redirect` (nginx, serving MEDIA_ROOT under the internal location
+# FILE_DOWNLOAD_ACCEL_PREFIX) or `x-sendfile` (Apache mod_xsendfile).
+FILE_DOWNLOAD_CHUNK_SIZE = int(os.getenv('FILE_DOWNLOAD_CHUNK_SIZE') or 65536)
+FILE_DOWNLOAD_SENDFILE = os.getenv('FILE_DOWNLOAD_SENDFILE') or ''
+FILE_DOWNLOAD_ACCEL_PREFIX = (os.getenv('FILE_DOWNLOAD_ACCEL_PREFIX')
+                              or '/protected-media/')
+
+# Polls
+
+# Serve the public polls pages with async views and push live vote counts
+# to the results page; only useful when running under an ASGI server, see
+# README.md.
+POLLS_ASYNC_VIEWS = (str(os.getenv('POLLS_ASYNC_VIEWS')).lower()
+                     in ['true', 'yes', '1'])
+
+# Number of counter shards per choice; 0 updates the vote counters directly.
+# Shards are folded back into the counters by `manage.py rollup_vote_shards`.
+VOTE_COUNT_SHARDS = int(os.getenv('VOTE_COUNT_SHARDS') or 0)
+
+# Stage votes in a buffer table and write them in batches with
+# `manage.py flush_vote_buffer` instead of on each request.
+VOTE_BUFFER = str(os.getenv('VOTE_BUFFER')).lower() in ['true', 'yes', '1']
+# Seconds between flushes and max votes written per flush
+VOTE_BUFFER_FLUSH_INTERVAL = float(
+    os.getenv('VOTE_BUFFER_FLUSH_INTERVAL') or 0.5)
+VOTE_BUFFER_BATCH_SIZE = int(os.getenv('VOTE_BUFFER_BATCH_SIZE') or 500)
+
+# Seconds rendered results are kept; entries are also replaced whenever
+# the vote counts of their question change.
+POLLS_RESULTS_CACHE_TIMEOUT = int(
+    os.getenv('POLLS_RESULTS_CACHE_TIMEOUT') or 3600)
+
+# Serve the public polls pages to anonymous users from the cache, for up
+# to POLLS_PAGE_CACHE_TIMEOUT seconds or until their content changes. The
+# home page's question list is also cached for up to that long.
+POLLS_PAGE_CACHE = (str(os.getenv('POLLS_PAGE_CACHE')).lower()
+                    in ['true', 'yes', '1'])
+POLLS_PAGE_CACHE_TIMEOUT = int(os.getenv('POLLS_PAGE_CACHE_TIMEOUT') or 3600)
+
+# Seconds between polls of the vote counts pushed by the live results stream
+POLLS_RESULTS_STREAM_INTERVAL = float(
+    os.getenv('POLLS_RESULTS_STREAM_INTERVAL') or 1)
+
+# Seconds a vote idempotency key is remembered, and how many recently seen
+# keys each process keeps in memory. Expired keys are removed from the
+# database by `manage.py prune_vote_submissions`.
+VOTE_SUBMISSION_KEY_TTL = int(os.getenv('VOTE_SUBMISSION_KEY_TTL') or 86400)
+VOTE_SUBMISSION_KEY_CACHE_SIZE = int(
+    os.getenv('VOTE_SUBMISSION_KEY_CACHE_SIZE') or 10000)
+
+# Seconds a vote is left out of the vote histogram buckets by
+# `manage.py count_vote_buckets`, so that votes with lower ids still being
+# committed are counted first.
+VOTE_BUCKET_DELAY = float(os.getenv('VOTE_BUCKET_DELAY') or 30)
+
+# Directory of the columnar vote archives written by
+# `manage.py export_votes`
+VOTE_ARCHIVE_DIR = Path(
+    os.getenv('VOTE_ARCHIVE_DIR') or BASE_DIR / 'vote_archive')
+
+# Widths in pixels of the resized copies of question thumbnails, their
+# WebP quality, and the number of worker processes rendering them; 0
+# renders them in the request that saved the thumbnail.
+POLLS_THUMBNAIL_WIDTHS = [
+    int(width) for width in
+    (os.getenv('POLLS_THUMBNAIL_WIDTHS') or '48,96,144').split(',')]
+POLLS_THUMBNAIL_QUALITY = int(os.getenv('POLLS_THUMBNAIL_QUALITY') or 80)
+POLLS_THUMBNAIL_WORKERS = int(os.getenv('POLLS_THUMBNAIL_WORKERS') or 2)
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
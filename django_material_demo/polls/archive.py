@@ -0,0 +1,204 @@
+"""
+Columnar file archive of votes moved out of the database.
+
+An archive is a directory holding one fixed-width little-endian array file
+per column, a JSON string table for the custom choice texts and a
+`meta.json` with the row count. Archives are memory-mapped when read, so
+results and histograms are computed with NumPy without loading the rows or
+touching the database.
+"""
+import json
+import shutil
+from datetime import datetime, timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+
+from .models import ArchivedVoteCount, Vote
+
+COLUMNS = {
+    'question_id': np.dtype('<i8'),
+    # -1 for custom votes
+    'choice_id': np.dtype('<i8'),
+    # microseconds since the epoch, UTC
+    'timestamp': np.dtype('<i8'),
+    # index in the string table, -1 for votes for a choice
+    'custom_text': np.dtype('<i4'),
+}
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+TIMESTAMP_UNIT = datetime.resolution
+
+
+def archive_path(name):
+    return settings.VOTE_ARCHIVE_DIR / name
+
+
+def archives():
+    """Return all the archives in `VOTE_ARCHIVE_DIR`, oldest name first."""
+    root = settings.VOTE_ARCHIVE_DIR
+    if not root.is_dir():
+        return []
+    return [VoteArchive(path) for path in sorted(root.iterdir())
+            if (path / 'meta.json').is_file()]
+
+
+def export_votes(questions, name, delete=False, chunk_size=10000):
+    """
+    Write the votes of `questions` to a new archive called `name`, streamed
+    from a server-side cursor `chunk_size` rows at a time. Returns the
+    number of votes exported.
+
+    With `delete` the exported votes are then removed from the database,
+    and their counts recorded in `ArchivedVoteCount` so the vote counters
+    still add up. Soft-deleted votes don't count and aren't exported, but
+    are removed along with the others.
+    """
+    path = archive_path(name)
+    question_ids = list(questions.values_list('pk', flat=True))
+    votes = Vote.objects.filter(question__in=question_ids).order_by('pk')
+    with transaction.atomic():
+        last_pk = votes.values_list('pk', flat=True).last()
+        if last_pk is None:
+            return 0
+        votes = votes.filter(pk__lte=last_pk)
+        rows = votes.values_list('question_id', 'choice_id', 'timestamp',
+                                 'custom_choice_text')
+        try:
+            count = write_archive(path, rows.iterator(chunk_size=chunk_size),
+                                  chunk_size)
+            if delete:
+                counts = (votes.order_by().values('question', 'choice')
+                          .annotate(vote_count=Count('pk')))
+                ArchivedVoteCount.objects.bulk_create([
+                    ArchivedVoteCount(
+                        question_id=row['question'], choice_id=row['choice'],
+                        partition='archive:%s' % name,
+                        vote_count=row['vote_count'])
+                    for row in counts])
+                # a single DELETE, without loading the votes to send
+                # signals; the vote counters are unchanged
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'DELETE FROM %s WHERE question_id = ANY(%%s) '
+                        'AND (id <= %%s OR deleted IS NOT NULL)'
+                        % connection.ops.quote_name(Vote._meta.db_table),
+                        [question_ids, last_pk])
+        except BaseException:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+    return count
+
+
+def write_archive(path, votes, chunk_size=10000):
+    """
+    Write `(question_id, choice_id, timestamp, custom_choice_text)` rows to
+    a new archive at `path`, `chunk_size` rows at a time. Returns the number
+    of rows written.
+    """
+    path.mkdir(parents=True)
+    files = {column: open(path / ('%s.bin' % column), 'wb')
+             for column in COLUMNS}
+    strings = {}
+    count = 0
+    try:
+        chunk = []
+        for vote in votes:
+            chunk.append(vote)
+            if len(chunk) == chunk_size:
+                write_chunk(files, strings, chunk)
+                count += len(chunk)
+                chunk = []
+        write_chunk(files, strings, chunk)
+        count += len(chunk)
+    finally:
+        for file in files.values():
+            file.close()
+
+    with open(path / 'strings.json', 'w') as file:
+        json.dump(list(strings), file)
+    # written last, an archive without it is incomplete
+    with open(path / 'meta.json', 'w') as file:
+        json.dump({'count': count,
+                   'columns': {column: dtype.str
+                               for column, dtype in COLUMNS.items()}},
+                  file)
+    return count
+
+
+def write_chunk(files, strings, chunk):
+    columns = {column: np.empty(len(chunk), dtype)
+               for column, dtype in COLUMNS.items()}
+    for row, (question_id, choice_id, timestamp, text) in enumerate(chunk):
+        columns['question_id'][row] = question_id
+        columns['choice_id'][row] = -1 if choice_id is None else choice_id
+        columns['timestamp'][row] = (timestamp - EPOCH) // TIMESTAMP_UNIT
+        columns['custom_text'][row] = (
+            strings.setdefault(text, len(strings)) if text else -1)
+    for column, values in columns.items():
+        values.tofile(files[column])
+
+
+class VoteArchive(object):
+    """Read-only, memory-mapped view of an archive."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path / 'meta.json') as file:
+            meta = json.load(file)
+        self.count = meta['count']
+        self.columns = {}
+        for column, dtype in meta['columns'].items():
+            if self.count:
+                self.columns[column] = np.memmap(
+                    path / ('%s.bin' % column), dtype=np.dtype(dtype),
+                    mode='r', shape=(self.count,))
+            else:
+                self.columns[column] = np.empty(0, np.dtype(dtype))
+        self._strings = None
+
+    @property
+    def name(self):
+        return self.path.name
+
+    @property
+    def strings(self):
+        if self._strings is None:
+            with open(self.path / 'strings.json') as file:
+                self._strings = json.load(file)
+        return self._strings
+
+    def question_mask(self, question_id):
+        return self.columns['question_id'] == question_id
+
+    def vote_counts(self, question_id):
+        """Return `{choice_id: vote_count}` of `question_id`."""
+        choice_ids = self.columns['choice_id'][self.question_mask(question_id)]
+        choice_ids, counts = np.unique(choice_ids[choice_ids >= 0],
+                                       return_counts=True)
+        return dict(zip(choice_ids.tolist(), counts.tolist()))
+
+    def custom_choice_counts(self, question_id):
+        """Return `{custom_choice_text: vote_count}` of `question_id`."""
+        texts = self.columns['custom_text'][self.question_mask(question_id)]
+        texts, counts = np.unique(texts[texts >= 0], return_counts=True)
+        return {self.strings[text]: count
+                for text, count in zip(texts.tolist(), counts.tolist())}
+
+    def histogram(self, question_id, seconds=3600):
+        """
+        Return `(start, choice_id, vote_count)` of each `seconds` long
+        bucket of `question_id`, oldest first. Custom votes have no choice
+        id.
+        """
+        mask = self.question_mask(question_id)
+        width = seconds * 1000000
+        starts = self.columns['timestamp'][mask] // width * width
+        buckets, counts = np.unique(
+            np.stack([starts, self.columns['choice_id'][mask]]), axis=1,
+            return_counts=True)
+        return [(EPOCH + start * TIMESTAMP_UNIT,
+                 None if choice_id < 0 else choice_id, count)
+                for (start, choice_id), count in zip(buckets.T.tolist(),
+                                                     counts.tolist())]
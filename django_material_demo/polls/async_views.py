@@ -0,0 +1,127 @@
+"""
+Async counterparts of the views in `polls.views`, enabled with the
+`POLLS_ASYNC_VIEWS` setting when served through `asgi.py`.
+
+Templates must not touch the database from the event loop, so everything
+they display is loaded into the context beforehand.
+"""
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import Http404, HttpResponseRedirect
+from django.shortcuts import render
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views import View
+
+from . import caching, services
+from .models import Question
+from .views import question_etag, read_ballot, results_etag
+
+
+async def load_user(request):
+    # resolve the lazy user (and the session) for the base template
+    await sync_to_async(lambda: request.user.is_authenticated)()
+
+
+async def get_question(queryset, pk):
+    try:
+        return await queryset.aget(pk=pk)
+    except Question.DoesNotExist:
+        raise Http404('No question found matching the query')
+
+
+async def conditional_response(request, etag_func, pk):
+    """
+    Async stand-in for the `condition` decorator. Returns a 304 response if
+    the client's copy is current, else None, and the ETag to send.
+    """
+    etag = await sync_to_async(etag_func)(request, pk)
+    if etag is None:
+        return None, None
+    etag = quote_etag(etag)
+    return get_conditional_response(request, etag=etag), etag
+
+
+async def question_context(question, idempotency_key=None):
+    return {
+        'question': question,
+        'choices': [choice async for choice in question.choice_set.all()],
+        'attachments': [
+            attachment async for attachment in question.attachment_set.all()],
+        # lets the vote form be resubmitted without counting twice
+        'idempotency_key': idempotency_key or uuid.uuid4().hex,
+    }
+
+
+class HomeView(View):
+    async def get(self, request):
+        """Render the last five published questions."""
+        context = {
+            'latest_question_list': await sync_to_async(
+                caching.latest_questions)(5),
+        }
+        await load_user(request)
+        return render(request, 'polls/home.html', context)
+
+
+class QuestionView(View):
+    async def get(self, request, pk):
+        response, etag = await conditional_response(
+            request, question_etag, pk)
+        if response is not None:
+            return response
+        # Excludes any questions that aren't published yet.
+        question = await get_question(
+            Question.objects.filter(pub_date__lte=timezone.now())
+            .prefetch_related('choice_set', 'attachment_set'), pk)
+        context = await question_context(
+            question, getattr(request, 'idempotency_key', None))
+        await load_user(request)
+        response = render(request, 'polls/question.html', context)
+        if etag is not None:
+            response['ETag'] = etag
+        return response
+
+
+class ResultsView(View):
+    async def get(self, request, pk):
+        response, etag = await conditional_response(
+            request, results_etag, pk)
+        if response is not None:
+            return response
+        question = await get_question(Question.objects.all(), pk)
+        context = {
+            'question': question,
+            'results_rows': await sync_to_async(caching.results_rows)(
+                question),
+            'stream_results': settings.POLLS_ASYNC_VIEWS,
+        }
+        await load_user(request)
+        response = render(request, 'polls/results.html', context)
+        if etag is not None:
+            response['ETag'] = etag
+        return response
+
+
+async def vote(request, question_id):
+    question = await get_question(Question.objects.all(), question_id)
+    try:
+        await sync_to_async(services.record_ballot)(
+            question, **read_ballot(request))
+    except ValueError:
+        error_message = "You didn't select a valid choice."
+    except ValidationError as e:
+        error_message = e.messages[0]
+    else:
+        return HttpResponseRedirect(
+            reverse('app_polls:results', args=(question.id,)))
+    # Redisplay the question voting form.
+    context = await question_context(question)
+    context['error_message'] = error_message
+    await load_user(request)
+    return render(request, 'polls/question.html', context)
@@ -0,0 +1,142 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils import timezone, translation
+from django.utils.safestring import mark_safe
+
+from . import services
+from .models import Question
+
+RESULTS_VERSION_KEY = 'polls:results-version:%s'
+RESULTS_ROWS_KEY = 'polls:results-rows:%s:%s:%s'
+LATEST_QUESTIONS_VERSION_KEY = 'polls:latest-questions-version'
+LATEST_QUESTIONS_KEY = 'polls:latest-questions:%s:%s'
+CSRF_TOKEN_PLACEHOLDER = 'polls-csrf-token-placeholder'
+IDEMPOTENCY_KEY_PLACEHOLDER = 'polls-idempotency-key-placeholder'
+
+
+def get_version(key):
+    """
+    Return the version stored at `key`, for keys of entries to be made
+    stale by `bump_version`.
+
+    A missing version starts from the clock rather than from 1, so that
+    entries cached under an evicted version are never served again.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # no version yet, the next reader starts a fresh one
+        pass
+
+
+def results_version(question_id):
+    """Return the current results version of a question."""
+    return get_version(RESULTS_VERSION_KEY % question_id)
+
+
+def bump_results_version(question_ids):
+    """Make cached results of the given questions stale."""
+    for question_id in set(question_ids):
+        bump_version(RESULTS_VERSION_KEY % question_id)
+
+
+def latest_questions(count=5):
+    """
+    Return the last `count` published questions.
+
+    The list is cached until a question is edited, the next scheduled
+    question is published or POLLS_PAGE_CACHE_TIMEOUT seconds have passed,
+    whichever comes first.
+    """
+    return latest_questions_entry(count)[0]
+
+
+def latest_questions_timeout(count=5):
+    """Return the seconds left before the latest questions change."""
+    expires = latest_questions_entry(count)[1]
+    if expires is None:
+        return None
+    return max((expires - timezone.now()).total_seconds(), 1)
+
+
+def latest_questions_entry(count):
+    key = LATEST_QUESTIONS_KEY % (
+        count, get_version(LATEST_QUESTIONS_VERSION_KEY))
+    entry = cache.get(key)
+    if entry is None:
+        now = timezone.now()
+        published = Question.objects.filter(pub_date__lte=now)
+        questions = list(published.order_by('-pub_date')[:count])
+        next_pub_date = (Question.objects.filter(pub_date__gt=now)
+                         .order_by('pub_date')
+                         .values_list('pub_date', flat=True).first())
+        entry = (questions, next_pub_date)
+        # edits only make the entry stale in the processes sharing the cache
+        timeout = settings.POLLS_PAGE_CACHE_TIMEOUT
+        if next_pub_date is not None:
+            timeout = min(max((next_pub_date - now).total_seconds(), 1),
+                          timeout)
+        cache.set(key, entry, timeout)
+    return entry
+
+
+def bump_latest_questions_version():
+    """Make the cached latest questions stale."""
+    bump_version(LATEST_QUESTIONS_VERSION_KEY)
+
+
+def results_rows(question):
+    """
+    Return the rendered vote count rows of `question`, from the cache when
+    its version is unchanged.
+    """
+    key = RESULTS_ROWS_KEY % (question.pk, translation.get_language(),
+                              results_version(question.pk))
+    rows = cache.get(key)
+    if rows is None:
+        choices = services.with_live_vote_count(question.choice_set.all())
+        rows = render_to_string(
+            'polls/includes/results_rows.html',
+            {'choices': choices,
+             'custom_choices': services.top_custom_choices(question)})
+        cache.set(key, str(rows), settings.POLLS_RESULTS_CACHE_TIMEOUT)
+    return mark_safe(rows)
+
+
+def page_cacheable(request):
+    """Whether the page for `request` may be served from the cache."""
+    return (settings.POLLS_PAGE_CACHE
+            and request.method in ('GET', 'HEAD')
+            and not request.user.is_authenticated
+            # pending messages are rendered into the page
+            and not len(messages.get_messages(request)))
+
+
+def page_key(name, *parts):
+    return 'polls:page:%s:%s:%s' % (
+        name, translation.get_language(), ':'.join(map(str, parts)))
+
+
+def fill_page_placeholders(request, content):
+    """Put the per-request values into a page rendered for the cache."""
+    idempotency_key = (getattr(request, 'idempotency_key', None)
+                       or uuid.uuid4().hex)
+    return (content
+            .replace(CSRF_TOKEN_PLACEHOLDER.encode(),
+                     get_token(request).encode())
+            .replace(IDEMPOTENCY_KEY_PLACEHOLDER.encode(),
+                     idempotency_key.encode()))
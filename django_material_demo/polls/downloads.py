@@ -0,0 +1,150 @@
+"""
+Download responses for uploaded files.
+
+Files on local storage are streamed `FILE_DOWNLOAD_CHUNK_SIZE` bytes at a
+time with support for single byte `Range` requests, or handed off to the
+front server with `FILE_DOWNLOAD_SENDFILE`. Files on other storages are
+redirected to their storage URL.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import (Http404, HttpResponse, HttpResponseRedirect,
+                         StreamingHttpResponse)
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Return the inclusive `(first, last)` byte positions requested by the
+    `Range` header, or None to send the whole file, which is allowed for
+    malformed and multiple ranges. Raises RangeNotSatisfiable.
+    """
+    match = BYTE_RANGE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # the last `last` bytes
+        length = int(last)
+        if not length or not size:
+            raise RangeNotSatisfiable
+        return max(size - length, 0), size - 1
+    first = int(first)
+    if last and int(last) < first:
+        return None
+    if first >= size:
+        raise RangeNotSatisfiable
+    return first, min(int(last), size - 1) if last else size - 1
+
+
+def read_chunks(path, offset, length, chunk_size):
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        while length > 0:
+            chunk = file.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def content_disposition(name, as_attachment=False):
+    filename = os.path.basename(name)
+    try:
+        filename.encode('ascii')
+        filename = 'filename="%s"' % (
+            filename.replace('\\', '\\\\').replace('"', r'\"'))
+    except UnicodeEncodeError:
+        filename = "filename*=utf-8''%s" % quote(filename)
+    return '%s; %s' % ('attachment' if as_attachment else 'inline', filename)
+
+
+def file_response(request, file, as_attachment=False, filename=None):
+    """
+    Return a response sending the `FieldFile` `file`, named `filename` or
+    after the file.
+    """
+    if not file:
+        raise Http404('No file.')
+    try:
+        path = file.storage.path(file.name)
+    except NotImplementedError:
+        return HttpResponseRedirect(file.url)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404('File not found.')
+
+    etag = quote_etag('%x-%x' % (stat.st_mtime_ns, stat.st_size))
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = send_file(request, file.name, path, stat.st_size, etag,
+                             last_modified)
+    if response.status_code in (200, 206):
+        content_type, encoding = mimetypes.guess_type(file.name)
+        if encoding:
+            # served as is, not to be decoded by the client
+            content_type = 'application/octet-stream'
+        response['Content-Type'] = content_type or 'application/octet-stream'
+        response['Content-Disposition'] = content_disposition(
+            filename or file.name, as_attachment)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def send_file(request, name, path, size, etag, last_modified):
+    sendfile = settings.FILE_DOWNLOAD_SENDFILE.lower()
+    if sendfile == 'x-accel-redirect':
+        # the front server handles ranges itself
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = quote(
+            settings.FILE_DOWNLOAD_ACCEL_PREFIX + name)
+        return response
+    if sendfile == 'x-sendfile':
+        response = HttpResponse()
+        response['X-Sendfile'] = path
+        return response
+
+    byte_range = None
+    if 'Range' in request.headers and if_range_matches(
+            request.headers.get('If-Range'), etag, last_modified):
+        try:
+            byte_range = parse_range(request.headers['Range'], size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%s' % size
+            return response
+
+    first, last = byte_range or (0, size - 1)
+    length = last - first + 1
+    response = StreamingHttpResponse(
+        read_chunks(path, first, length, settings.FILE_DOWNLOAD_CHUNK_SIZE),
+        status=206 if byte_range else 200)
+    response['Content-Length'] = length
+    if byte_range:
+        response['Content-Range'] = 'bytes %s-%s/%s' % (first, last, size)
+    return response
+
+
+def if_range_matches(if_range, etag, last_modified):
+    """Whether a `Range` with the `If-Range` header `if_range` applies."""
+    if if_range is None:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
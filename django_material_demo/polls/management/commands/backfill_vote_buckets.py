@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from polls.services import rebuild_vote_buckets
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the minute and hour vote histogram buckets from the '
+            'Vote table.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of votes read per query.')
+
+    def handle(self, *args, **options):
+        total = 0
+        for total in rebuild_vote_buckets(options['batch_size']):
+            if options['verbosity'] > 1:
+                self.stdout.write('Counted %s vote(s)...' % total)
+        self.stdout.write('Counted %s vote(s).' % total)
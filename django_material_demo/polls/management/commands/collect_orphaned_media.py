@@ -0,0 +1,96 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+
+from polls.models import Attachment, Question
+from polls.storage import BLOB_PREFIX, UPLOAD_PREFIX, delete_files, list_files
+from polls.uploads import TOKEN_MAX_AGE
+
+
+class Command(BaseCommand):
+    help = ('Delete the files of the file storage no attachment or question '
+            'refers to.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours', type=float, default=24,
+            help='Keep files modified within this many hours, as they may '
+                 'belong to forms being saved. Defaults to 24.')
+        parser.add_argument(
+            '--skip', action='append', default=[], metavar='PREFIX',
+            help='Keep the files under this prefix, can be repeated.')
+        parser.add_argument(
+            '--workers', type=int, default=8,
+            help='Number of directories listed at once. Defaults to 8.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of files deleted at once. Defaults to 1000.')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='List the orphaned files without deleting them.')
+
+    def handle(self, *args, **options):
+        referenced = set(Attachment.objects.exclude(file='')
+                         .values_list('file', flat=True).iterator())
+        # deleted questions are kept with their thumbnails
+        for name, variants in (Question.all_objects
+                               .values_list('thumbnail', 'thumbnail_variants')
+                               .iterator()):
+            referenced.add(name)
+            if variants:
+                referenced.update(variants['widths'].values())
+
+        now = timezone.now()
+        cutoff = now - timedelta(hours=options['grace_hours'])
+        # direct uploads are submitted with the form until their token expires
+        upload_cutoff = min(cutoff, now - timedelta(seconds=TOKEN_MAX_AGE))
+        # blobs are deleted by `sweep_blobs`
+        skipped = tuple(options['skip']) + (BLOB_PREFIX,)
+
+        count = 0
+        size = 0
+        batch = []
+        for name, file_size, modified in self.walk(options['workers'],
+                                                   skipped):
+            if (name in referenced or modified >= (
+                    upload_cutoff if name.startswith(UPLOAD_PREFIX)
+                    else cutoff)):
+                continue
+            count += 1
+            size += file_size
+            if options['dry_run']:
+                self.stdout.write(name)
+                continue
+            batch.append(name)
+            if len(batch) >= options['batch_size']:
+                delete_files(default_storage, batch)
+                batch = []
+        if batch:
+            delete_files(default_storage, batch)
+
+        self.stdout.write('%s %s orphaned file(s) of %s.' % (
+            'Found' if options['dry_run'] else 'Deleted',
+            count, filesizeformat(size)))
+
+    def walk(self, workers, skipped):
+        """
+        Yield the `(name, size, modified)` of the files of the storage not
+        under the prefixes `skipped`, listing `workers` directories at once.
+        """
+        with ThreadPoolExecutor(workers) as pool:
+            pending = {pool.submit(list_files, default_storage, '')}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    directories, files = future.result()
+                    pending.update(
+                        pool.submit(list_files, default_storage, directory)
+                        for directory in directories
+                        if not (directory + '/').startswith(skipped))
+                    for file in files:
+                        if not file[0].startswith(skipped):
+                            yield file
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from polls.services import count_new_vote_buckets
+
+
+class Command(BaseCommand):
+    help = ('Add the votes written since the last run to the minute and hour '
+            'vote histogram buckets.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Keep running, counting new votes every INTERVAL seconds.')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Max number of votes counted per transaction.')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        batch_size = options['batch_size']
+        while True:
+            total = 0
+            # catch up on full batches without waiting
+            while True:
+                count = count_new_vote_buckets(batch_size)
+                total += count
+                if count < batch_size:
+                    break
+            if options['verbosity'] > 1 or not interval:
+                self.stdout.write('Counted %s vote(s).' % total)
+            if not interval:
+                break
+            time.sleep(interval)
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from polls.archive import archive_path, export_votes
+from polls.models import Question
+
+
+class Command(BaseCommand):
+    help = ('Write the votes of closed questions to a columnar archive in '
+            'VOTE_ARCHIVE_DIR.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'question_ids', nargs='*', type=int,
+            help='Questions to export, by default all closed questions.')
+        parser.add_argument(
+            '--name',
+            help='Archive name, by default the current date and time.')
+        parser.add_argument(
+            '--delete', action='store_true',
+            help=('Delete the exported votes, and the soft-deleted votes of '
+                  'the questions, from the database.'))
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='Number of votes fetched from the database at a time.')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        questions = Question.objects.filter(vote_end__lte=now)
+        if options['question_ids']:
+            questions = questions.filter(pk__in=options['question_ids'])
+        name = options['name'] or now.strftime('votes-%Y%m%d-%H%M%S')
+        if archive_path(name).exists():
+            raise CommandError('Archive %s already exists.' % name)
+
+        count = export_votes(questions, name, delete=options['delete'],
+                             chunk_size=options['chunk_size'])
+        self.stdout.write('Exported %s vote(s) to %s.' % (count, name))
@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from polls.services import flush_vote_buffer
+
+
+class Command(BaseCommand):
+    help = ('Write buffered votes to the Vote table and the vote counters. '
+            'Votes left over by an interrupted run are replayed on start.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float,
+            default=settings.VOTE_BUFFER_FLUSH_INTERVAL,
+            help='Seconds to wait between flushes.')
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=settings.VOTE_BUFFER_BATCH_SIZE,
+            help='Max number of votes written per transaction.')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Drain the buffer once and exit.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        while True:
+            total = 0
+            # drain full batches without waiting
+            while True:
+                count = flush_vote_buffer(batch_size)
+                total += count
+                if count < batch_size:
+                    break
+            if options['once'] or (total and options['verbosity'] > 1):
+                self.stdout.write('Flushed %s vote(s).' % total)
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,43 @@
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from polls.partitions import (create_vote_partitions, detach_vote_partitions,
+                              is_partitioned, month_start, next_month,
+                              previous_month)
+
+
+class Command(BaseCommand):
+    help = ('Create the coming monthly partitions of the vote table and '
+            'detach old ones. PostgreSQL only.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead', type=int, default=3,
+            help='Number of months to create partitions for in advance.')
+        parser.add_argument(
+            '--retain-months', type=int,
+            help='Detach the partitions older than this many months.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Vote partitioning requires PostgreSQL.')
+        with connection.cursor() as cursor:
+            if not is_partitioned(cursor):
+                raise CommandError('The vote table is not partitioned, '
+                                   'run the polls migrations first.')
+
+        this_month = month_start(datetime.now(timezone.utc))
+        until = this_month
+        for _ in range(options['months_ahead']):
+            until = next_month(until)
+        for name in create_vote_partitions(connection, until):
+            self.stdout.write('Created %s.' % name)
+
+        if options['retain_months'] is not None:
+            before = this_month
+            for _ in range(options['retain_months']):
+                before = previous_month(before)
+            for name in detach_vote_partitions(connection, before):
+                self.stdout.write('Detached %s.' % name)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from polls.services import prune_vote_submissions
+
+
+class Command(BaseCommand):
+    help = 'Delete vote idempotency keys older than VOTE_SUBMISSION_KEY_TTL.'
+
+    def handle(self, *args, **options):
+        count = prune_vote_submissions()
+        self.stdout.write('Deleted %s expired key(s).' % count)
@@ -0,0 +1,61 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Max, Min
+
+from polls.models import Question
+from polls.services import reconcile_vote_counts
+
+
+def reconcile_range(question_ids, dry_run):
+    drifts = reconcile_vote_counts(*question_ids, dry_run=dry_run)
+    return [(model.__name__, pk, recorded, counted)
+            for model, pk, recorded, counted in drifts]
+
+
+class Command(BaseCommand):
+    help = ('Recount Choice.vote_count and Question.total_vote_count from '
+            'the Vote table and correct the ones that drifted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report drifted counters without correcting them.')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Number of worker processes.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Number of question ids recounted per transaction.')
+
+    def handle(self, *args, **options):
+        bounds = Question.objects.aggregate(first=Min('pk'), last=Max('pk'))
+        if bounds['first'] is None:
+            return
+        chunk_size = options['chunk_size']
+        ranges = [(start, start + chunk_size - 1)
+                  for start in range(bounds['first'], bounds['last'] + 1,
+                                     chunk_size)]
+
+        if options['workers'] > 1 and len(ranges) > 1:
+            # forked workers must open their own database connections
+            connections.close_all()
+            with ProcessPoolExecutor(
+                    max_workers=options['workers'],
+                    mp_context=multiprocessing.get_context('fork')) as pool:
+                results = pool.map(reconcile_range, ranges,
+                                   [options['dry_run']] * len(ranges))
+                drifts = [drift for result in results for drift in result]
+        else:
+            drifts = [drift for question_ids in ranges
+                      for drift in reconcile_range(question_ids,
+                                                   options['dry_run'])]
+
+        for model, pk, recorded, counted in drifts:
+            self.stdout.write('%s #%s: recorded %s, counted %s' % (
+                model, pk, recorded, counted))
+        self.stdout.write('%s %s counter(s).' % (
+            'Found' if options['dry_run'] else 'Corrected', len(drifts)))
@@ -0,0 +1,51 @@
+from concurrent.futures import as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from polls.models import Question
+from polls.thumbnails import (get_pool, render_variants,
+                              render_variants_in_worker, variants_rendered)
+
+
+class Command(BaseCommand):
+    help = ('Render the resized copies of the question thumbnails that '
+            'have none yet.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Render the copies of every thumbnail again.')
+
+    def handle(self, *args, **options):
+        questions = (Question.objects.exclude(thumbnail='')
+                     .exclude(thumbnail__isnull=True)
+                     .values_list('pk', 'thumbnail', 'thumbnail_variants'))
+        thumbnails = [(pk, name) for pk, name, variants in questions
+                      if options['all']
+                      or (variants or {}).get('name') != name]
+
+        failed = 0
+        if settings.POLLS_THUMBNAIL_WORKERS:
+            pool = get_pool()
+            futures = {pool.submit(render_variants_in_worker, pk, name): pk
+                       for pk, name in thumbnails}
+            results = ((futures[future], future.exception())
+                       for future in as_completed(futures))
+        else:
+            results = (self.render(pk, name) for pk, name in thumbnails)
+        for pk, error in results:
+            if error is None:
+                variants_rendered(pk)
+            else:
+                failed += 1
+                self.stderr.write('Question #%s: %s' % (pk, error))
+        self.stdout.write('Rendered %s thumbnail(s).' % (
+            len(thumbnails) - failed))
+
+    def render(self, pk, name):
+        try:
+            render_variants(pk, name)
+        except Exception as e:
+            return pk, e
+        return pk, None
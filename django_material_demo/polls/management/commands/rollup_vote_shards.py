@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from polls.services import rollup_vote_shards
+
+
+class Command(BaseCommand):
+    help = ('Fold votes held in counter shards into Choice.vote_count and '
+            'Question.total_vote_count.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Keep running, rolling up every INTERVAL seconds.')
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            count = rollup_vote_shards()
+            if options['verbosity'] > 1 or not interval:
+                self.stdout.write('Rolled up %s vote(s).' % count)
+            if not interval:
+                break
+            time.sleep(interval)
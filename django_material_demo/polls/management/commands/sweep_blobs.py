@@ -0,0 +1,58 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+
+from polls.models import Attachment, Blob, Question
+from polls.storage import ContentAddressedMixin
+
+
+class Command(BaseCommand):
+    help = ('Recount the references to the blobs of the content-addressed '
+            'storage and delete the unreferenced ones.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours', type=float, default=24,
+            help='Keep unreferenced blobs used within this many hours, as '
+                 'they may belong to forms being saved. Defaults to 24.')
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, ContentAddressedMixin):
+            raise CommandError('The default storage is not content-addressed.')
+        references = Counter()
+        for name in (Attachment.objects.exclude(file='')
+                     .values_list('file', flat=True).iterator()):
+            references[name] += 1
+        # deleted questions are kept with their thumbnails
+        for name, variants in (Question.all_objects
+                               .values_list('thumbnail', 'thumbnail_variants')
+                               .iterator()):
+            if name:
+                references[name] += 1
+            if variants:
+                references.update(variants['widths'].values())
+
+        recounted = []
+        for blob in Blob.objects.only('id', 'name', 'ref_count').iterator():
+            if blob.ref_count != references[blob.name]:
+                blob.ref_count = references[blob.name]
+                recounted.append(blob)
+        Blob.objects.bulk_update(recounted, ['ref_count'], batch_size=500)
+
+        cutoff = timezone.now() - timedelta(hours=options['grace_hours'])
+        swept = 0
+        size = 0
+        for pk, name, blob_size in (Blob.objects
+                                    .filter(ref_count=0, last_used__lt=cutoff)
+                                    .values_list('id', 'name', 'size')):
+            # saving the content again in the meantime revives the blob
+            if Blob.objects.filter(pk=pk, last_used__lt=cutoff).delete()[0]:
+                default_storage.delete_blob(name)
+                swept += 1
+                size += blob_size
+        self.stdout.write('Recounted %s blob(s), deleted %s blob(s) of %s.' % (
+            len(recounted), swept, filesizeformat(size)))
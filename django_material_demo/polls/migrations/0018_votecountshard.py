@@ -0,0 +1,30 @@
+# Generated by Django 4.1 on 2026-10-18 20:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0017_remove_choice_deleted_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteCountShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.IntegerField()),
+                ('vote_count', models.IntegerField(default=0)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vote_shards', to='polls.choice')),
+            ],
+            options={
+                'ordering': ['choice', 'shard'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='votecountshard',
+            constraint=models.UniqueConstraint(fields=('choice', 'shard'), name='unique_choice_vote_shard'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.1 on 2026-10-18 20:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0018_votecountshard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BufferedVote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('is_custom', models.BooleanField(default=False)),
+                ('custom_choice_text', models.CharField(blank=True, max_length=200, null=True)),
+                ('choice', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='polls.choice')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1 on 2026-10-18 20:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0019_bufferedvote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bufferedvote',
+            name='ballot',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='ballot',
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+    ]
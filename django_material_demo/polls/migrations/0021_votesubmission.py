@@ -0,0 +1,25 @@
+# Generated by Django 4.1 on 2026-10-18 20:52
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0020_vote_ballot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteSubmission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('created', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-created', 'id'],
+            },
+        ),
+    ]
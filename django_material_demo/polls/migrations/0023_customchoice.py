@@ -0,0 +1,65 @@
+# Generated by Django 4.1 on 2026-10-18 20:59
+
+import hashlib
+from collections import Counter
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def add_custom_choices(apps, schema_editor):
+    vote_model = apps.get_model('polls', 'Vote')
+    custom_choice_model = apps.get_model('polls', 'CustomChoice')
+
+    texts = {}
+    counts = Counter()
+    votes = (vote_model.objects
+             .filter(is_custom=True, deleted__isnull=True)
+             .exclude(custom_choice_text__isnull=True)
+             .exclude(custom_choice_text='')
+             .order_by('pk')
+             .values_list('question_id', 'custom_choice_text'))
+    for question_id, text in votes.iterator():
+        text = ' '.join(text.split())
+        text_hash = hashlib.sha256(text.casefold().encode()).hexdigest()
+        texts.setdefault((question_id, text_hash), text)
+        counts[question_id, text_hash] += 1
+
+    custom_choice_model.objects.bulk_create(
+        [custom_choice_model(question_id=question_id, text_hash=text_hash,
+                             text=texts[question_id, text_hash],
+                             vote_count=count)
+         for (question_id, text_hash), count in counts.items()],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0022_question_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomChoice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.CharField(max_length=200)),
+                ('text_hash', models.CharField(max_length=64)),
+                ('vote_count', models.IntegerField(default=0)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='custom_choices', to='polls.question')),
+            ],
+            options={
+                'ordering': ['-vote_count', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='customchoice',
+            index=models.Index(fields=['question', '-vote_count'], name='custom_choice_top_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='customchoice',
+            constraint=models.UniqueConstraint(fields=('question', 'text_hash'), name='unique_custom_choice_text'),
+        ),
+        migrations.RunPython(add_custom_choices, migrations.RunPython.noop),
+    ]
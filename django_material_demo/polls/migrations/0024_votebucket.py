@@ -0,0 +1,36 @@
+# Generated by Django 4.1 on 2026-10-18 21:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0023_customchoice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('MINUTE', 'minute'), ('HOUR', 'hour')], max_length=10)),
+                ('start', models.DateTimeField()),
+                ('vote_count', models.IntegerField(default=0)),
+                ('choice', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='vote_buckets', to='polls.choice')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vote_buckets', to='polls.question')),
+            ],
+            options={
+                'ordering': ['question', 'resolution', 'start', 'choice'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='votebucket',
+            constraint=models.UniqueConstraint(condition=models.Q(('choice__isnull', False)), fields=('question', 'resolution', 'start', 'choice'), name='unique_choice_vote_bucket'),
+        ),
+        migrations.AddConstraint(
+            model_name='votebucket',
+            constraint=models.UniqueConstraint(condition=models.Q(('choice__isnull', True)), fields=('question', 'resolution', 'start'), name='unique_custom_vote_bucket'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.1 on 2026-10-18 21:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0024_votebucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedVoteCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('partition', models.CharField(max_length=63)),
+                ('vote_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['partition', 'question', 'choice'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['timestamp', 'id'], name='vote_timestamp_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedvotecount',
+            name='choice',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='polls.choice'),
+        ),
+        migrations.AddField(
+            model_name='archivedvotecount',
+            name='question',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+from polls.partitions import (detached_vote_partitions, drop_id_default,
+                              is_partitioned, rebuild_vote_table)
+
+
+def partition_votes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            rebuild_vote_table(cursor, partition_by='"timestamp"')
+
+
+def unpartition_votes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        # detached partitions are kept as archives, but those detached
+        # before their copied id default was dropped would keep the id
+        # sequence from being dropped with the partitioned table
+        for name in detached_vote_partitions(cursor):
+            drop_id_default(cursor, name)
+        if is_partitioned(cursor):
+            rebuild_vote_table(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0025_archivedvotecount_vote_timestamp_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_votes, unpartition_votes),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1 on 2026-10-18 21:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0026_partition_vote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='thumbnail_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
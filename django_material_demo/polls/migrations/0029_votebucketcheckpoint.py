@@ -0,0 +1,20 @@
+# Generated by Django 4.1 on 2026-10-18 22:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0028_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteBucketCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_vote_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.1 on 2026-10-18 22:52
+
+import os
+
+from django.db import migrations, models
+import polls.models
+
+
+def fill_filenames(apps, schema_editor):
+    # best effort, attachments sharing a blob get the name of its first upload
+    Attachment = apps.get_model('polls', 'Attachment')
+    attachments = list(Attachment.objects.exclude(file='').exclude(file=None))
+    for attachment in attachments:
+        attachment.filename = os.path.basename(attachment.file.name)
+    Attachment.objects.bulk_update(attachments, ['filename'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0029_votebucketcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='attachment',
+            options={'ordering': ['filename', 'id']},
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='filename',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='attachment',
+            name='file',
+            field=models.FileField(blank=True, null=True, upload_to=polls.models.attachment_upload_to),
+        ),
+        migrations.RunPython(fill_filenames, migrations.RunPython.noop),
+    ]
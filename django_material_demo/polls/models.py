@@ -1,9 +1,15 @@
+import hashlib
+import os
+
 from django.conf import settings
 from django.contrib import admin
+from django.core.files.storage import default_storage
 from django.db import models
 from django.utils import timezone
 from safedelete.models import SafeDeleteModel
 
+from .storage import BLOB_PREFIX, storage_urls
+
 
 class User(SafeDeleteModel):
     account = models.OneToOneField(
@@ -68,6 +74,8 @@ class Question(SafeDeleteModel):
     total_vote_count = models.IntegerField(default=0)
 
     thumbnail = models.FileField(blank=True, null=True)
+    # resized copies of the thumbnail, see `polls.thumbnails`
+    thumbnail_variants = models.JSONField(default=dict, blank=True)
 
     creator = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name='question_creates',
@@ -96,6 +104,7 @@ class Question(SafeDeleteModel):
     has_max_vote_count = models.BooleanField(default=False)
     max_vote_count = models.IntegerField(null=True, blank=True)
     allow_custom = models.BooleanField('allow custom votes', default=False)
+    modified = models.DateTimeField('last modified', auto_now=True)
 
     class Meta:
         ordering = ['question_text', 'id']
@@ -106,6 +115,15 @@ class Question(SafeDeleteModel):
     class Meta:
         ordering = ['question_text']
 
+    def can_show_votes(self, now=None):
+        """Whether vote counts may be shown to the public at `now`."""
+        if self.show_vote == self.ShowVote.NEVER:
+            return False
+        if self.show_vote == self.ShowVote.END:
+            return (self.vote_end is not None
+                    and self.vote_end <= (now or timezone.now()))
+        return True
+
     @admin.display()
     def selection_bounds(self):
         if self.min_selection == self.max_selection:
@@ -115,11 +133,36 @@ class Question(SafeDeleteModel):
                 'min': self.min_selection or 1,
                 'max': self.max_selection or 'unbounded'}
 
+    def thumbnail_srcset(self):
+        """
+        Return the `srcset` of the thumbnail, or '' until its variants are
+        rendered.
+        """
+        variants = self.thumbnail_variants or {}
+        if not self.thumbnail or variants.get('name') != self.thumbnail.name:
+            return ''
+        urls = storage_urls(default_storage, variants['widths'].values())
+        candidates = ['%s %sw' % (urls[name], width)
+                      for width, name in variants['widths'].items()]
+        candidates.append('%s %sw' % (self.thumbnail.url, variants['width']))
+        return ', '.join(candidates)
+
     def choice_list(self):
         choices = Choice.objects.filter(question=self)
         choices = choices.order_by('choice_text')
         return list(choices.values_list('choice_text', flat=True))
 
+    @classmethod
+    def choice_lists(cls, questions):
+        """Return the `choice_list` of each of `questions` by pk."""
+        choice_lists = {question.pk: [] for question in questions}
+        choices = Choice.objects.filter(question__in=questions)
+        choices = choices.order_by('choice_text')
+        for question_id, choice_text in choices.values_list('question',
+                                                            'choice_text'):
+            choice_lists[question_id].append(choice_text)
+        return choice_lists
+
 
 class Choice(models.Model):
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
@@ -133,6 +176,29 @@ class Choice(models.Model):
         return self.choice_text
 
 
+class VoteCountShard(models.Model):
+    """
+    Pending vote count for a choice, spread over several rows so concurrent
+    voters don't all wait on the same row lock. Shards are periodically
+    rolled up into `Choice.vote_count` and `Question.total_vote_count`.
+    """
+    choice = models.ForeignKey(
+        Choice, on_delete=models.CASCADE, related_name='vote_shards')
+    shard = models.IntegerField()
+    vote_count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['choice', 'shard']
+        constraints = [
+            models.UniqueConstraint(fields=['choice', 'shard'],
+                                    name='unique_choice_vote_shard'),
+        ]
+
+    def __str__(self):
+        return '%(choice)s #%(shard)s' % {
+            'choice': str(self.choice), 'shard': self.shard}
+
+
 class Vote(SafeDeleteModel):
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     timestamp = models.DateTimeField(default=timezone.now)
@@ -141,9 +207,15 @@ class Vote(SafeDeleteModel):
         Choice, on_delete=models.CASCADE, null=True, blank=True)
     custom_choice_text = models.CharField(
         max_length=200, null=True, blank=True)
+    # shared by the votes cast together on a multi-selection ballot
+    ballot = models.UUIDField(null=True, blank=True, db_index=True)
 
     class Meta:
         ordering = ['-timestamp', 'id']
+        indexes = [
+            models.Index(fields=['timestamp', 'id'],
+                         name='vote_timestamp_idx'),
+        ]
 
     def __str__(self):
         return '#%(id)s (%(question)s)' % {
@@ -157,15 +229,203 @@ class Vote(SafeDeleteModel):
             return str(self.choice)
 
 
+class CustomChoice(models.Model):
+    """
+    Running count of the custom votes of a question whose texts match when
+    compared case- and whitespace-insensitively.
+    """
+    question = models.ForeignKey(
+        Question, on_delete=models.CASCADE, related_name='custom_choices')
+    text = models.CharField(max_length=200)
+    text_hash = models.CharField(max_length=64)
+    vote_count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['-vote_count', 'id']
+        constraints = [
+            models.UniqueConstraint(fields=['question', 'text_hash'],
+                                    name='unique_custom_choice_text'),
+        ]
+        indexes = [
+            models.Index(fields=['question', '-vote_count'],
+                         name='custom_choice_top_idx'),
+        ]
+
+    def __str__(self):
+        return self.text
+
+    @staticmethod
+    def hash_text(text):
+        folded = ' '.join(text.split()).casefold()
+        return hashlib.sha256(folded.encode()).hexdigest()
+
+
+class VoteBucket(models.Model):
+    """
+    Number of votes a choice got in one minute or hour, for vote-over-time
+    charts, counted from new votes by `manage.py count_vote_buckets`.
+    Custom votes are counted with no choice.
+    """
+    class Resolution(models.TextChoices):
+        MINUTE = 'MINUTE', 'minute'
+        HOUR = 'HOUR', 'hour'
+
+    question = models.ForeignKey(
+        Question, on_delete=models.CASCADE, related_name='vote_buckets')
+    choice = models.ForeignKey(
+        Choice, on_delete=models.CASCADE, null=True, blank=True,
+        related_name='vote_buckets')
+    resolution = models.CharField(max_length=10, choices=Resolution.choices)
+    start = models.DateTimeField()
+    vote_count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['question', 'resolution', 'start', 'choice']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['question', 'resolution', 'start', 'choice'],
+                condition=models.Q(choice__isnull=False),
+                name='unique_choice_vote_bucket'),
+            models.UniqueConstraint(
+                fields=['question', 'resolution', 'start'],
+                condition=models.Q(choice__isnull=True),
+                name='unique_custom_vote_bucket'),
+        ]
+
+    def __str__(self):
+        return '%(question)s %(start)s (%(resolution)s)' % {
+            'question': str(self.question), 'start': self.start,
+            'resolution': self.resolution}
+
+    @classmethod
+    def starts(cls, timestamp):
+        """Return the start of each bucket `timestamp` falls into."""
+        minute = timestamp.replace(second=0, microsecond=0)
+        return {cls.Resolution.MINUTE: minute,
+                cls.Resolution.HOUR: minute.replace(minute=0)}
+
+
+class VoteBucketCheckpoint(models.Model):
+    """Single row holding the id of the last vote counted in `VoteBucket`."""
+    last_vote_id = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return 'Vote #%s' % self.last_vote_id
+
+
+class ArchivedVoteCount(models.Model):
+    """
+    Votes of a choice moved out of `Vote`, either in a vote table partition
+    detached by `manage.py manage_vote_partitions` or in a file archive
+    written by `manage.py export_votes`.
+    """
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(
+        Choice, on_delete=models.CASCADE, null=True, blank=True)
+    # partition table name, or `archive:<name>`
+    partition = models.CharField(max_length=63)
+    vote_count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['partition', 'question', 'choice']
+
+    def __str__(self):
+        return '%(partition)s: %(question)s' % {
+            'partition': self.partition, 'question': str(self.question)}
+
+
+class BufferedVote(models.Model):
+    """
+    Vote accepted but not yet written to `Vote` and the vote counters.
+    Rows are drained in batches by `manage.py flush_vote_buffer`.
+    """
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    timestamp = models.DateTimeField(default=timezone.now)
+    is_custom = models.BooleanField(default=False)
+    choice = models.ForeignKey(
+        Choice, on_delete=models.CASCADE, null=True, blank=True)
+    custom_choice_text = models.CharField(
+        max_length=200, null=True, blank=True)
+    ballot = models.UUIDField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return '#%(id)s (%(question)s)' % {
+            'question': str(self.question),
+            'id': str(self.pk)}
+
+    FIELDS = ['question_id', 'timestamp', 'is_custom', 'choice_id',
+              'custom_choice_text', 'ballot']
+
+    @classmethod
+    def from_vote(cls, vote):
+        return cls(**{field: getattr(vote, field) for field in cls.FIELDS})
+
+    def to_vote(self):
+        return Vote(**{field: getattr(self, field) for field in self.FIELDS})
+
+
+class VoteSubmission(models.Model):
+    """
+    Idempotency key of an accepted vote submission, so that retried
+    submissions are only counted once.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        ordering = ['-created', 'id']
+
+    def __str__(self):
+        return self.key
+
+
+def attachment_upload_to(instance, filename):
+    # blobs keep the name of their first upload, not this one
+    instance.filename = os.path.basename(filename)
+    return filename
+
+
 class Attachment(models.Model):
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
-    file = models.FileField(blank=True, null=True)
+    file = models.FileField(upload_to=attachment_upload_to, blank=True,
+                            null=True)
+    # name of the file as uploaded, shown and downloaded as
+    filename = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        ordering = ['filename', 'id']
+
+    def __str__(self):
+        return self.filename or str(self.file)
+
+    def save(self, *args, **kwargs):
+        # files saved through the storage are named by `attachment_upload_to`
+        if self.file and not self.file.name.startswith(BLOB_PREFIX):
+            self.filename = os.path.basename(self.file.name)
+        super().save(*args, **kwargs)
+
+
+class Blob(models.Model):
+    """
+    File content stored once by a `polls.storage.ContentAddressedMixin`
+    storage, under the name of its first upload. `ref_count` goes up each
+    time the content is saved, and is recounted from the rows referring to
+    the blob by `manage.py sweep_blobs`, which deletes unreferenced blobs.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    last_used = models.DateTimeField(default=timezone.now)
 
     class Meta:
-        ordering = ['file', 'id']
+        ordering = ['id']
 
     def __str__(self):
-        return str(self.file)
+        return self.name
 
 
 class QuestionFollower(models.Model):
@@ -0,0 +1,190 @@
+"""
+Monthly range partitioning of the vote table on `timestamp`, PostgreSQL
+only.
+
+Votes of month M live in the partition `polls_vote_pYYYY_MM`, and votes
+outside every month partition in `polls_vote_default`. Partitions are made
+ahead of time and old ones detached by `manage.py manage_vote_partitions`.
+"""
+import re
+from datetime import datetime, timedelta, timezone
+
+from django.db import transaction
+
+VOTE_TABLE = 'polls_vote'
+DEFAULT_PARTITION = VOTE_TABLE + '_default'
+PARTITION_NAME = re.compile(r'^%s_p(\d{4})_(\d{2})$' % VOTE_TABLE)
+
+
+def month_start(value):
+    return value.astimezone(timezone.utc).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(month):
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def previous_month(month):
+    return month_start(month - timedelta(days=1))
+
+
+def partition_name(month):
+    return '%s_p%s' % (VOTE_TABLE, month.strftime('%Y_%m'))
+
+
+def is_partitioned(cursor):
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+        "WHERE partrelid = to_regclass(%s))", [VOTE_TABLE])
+    return cursor.fetchone()[0]
+
+
+def vote_partitions(cursor):
+    """Return `{month: name}` of the attached month partitions."""
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = %s::regclass", [VOTE_TABLE])
+    partitions = {}
+    for name, in cursor.fetchall():
+        match = PARTITION_NAME.match(name)
+        if match:
+            month = datetime(int(match[1]), int(match[2]), 1,
+                             tzinfo=timezone.utc)
+            partitions[month] = name
+    return partitions
+
+
+def detached_vote_partitions(cursor):
+    """Return the names of the month partitions kept after being detached."""
+    cursor.execute(
+        "SELECT relname FROM pg_class WHERE relkind = 'r' "
+        "AND NOT relispartition AND relname LIKE %s",
+        [VOTE_TABLE + r'\_p%'])
+    return sorted(name for name, in cursor.fetchall()
+                  if PARTITION_NAME.match(name))
+
+
+def drop_id_default(cursor, name):
+    # the copied default depends on the vote table's id sequence, which
+    # could then no longer be dropped with the table
+    cursor.execute('ALTER TABLE %s ALTER COLUMN id DROP DEFAULT' % name)
+
+
+def create_vote_partitions(connection, until):
+    """
+    Create the missing month partitions from the current month up to the
+    month of `until`. Returns the names of the created partitions.
+    """
+    created = []
+    with connection.cursor() as cursor, transaction.atomic(
+            using=connection.alias):
+        existing = vote_partitions(cursor)
+        month = month_start(datetime.now(timezone.utc))
+        while month <= until:
+            if month not in existing:
+                create_partition(cursor, month)
+                created.append(partition_name(month))
+            month = next_month(month)
+    return created
+
+
+def create_partition(cursor, month):
+    # votes of the month may already sit in the default partition, they
+    # must be moved before the new partition can be attached
+    name = partition_name(month)
+    bounds = [month, next_month(month)]
+    cursor.execute(
+        'CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+        % (name, VOTE_TABLE))
+    drop_id_default(cursor, name)
+    cursor.execute(
+        'WITH moved AS (DELETE FROM %s WHERE "timestamp" >= %%s '
+        'AND "timestamp" < %%s RETURNING *) '
+        'INSERT INTO %s SELECT * FROM moved'
+        % (DEFAULT_PARTITION, name), bounds)
+    cursor.execute(
+        "ALTER TABLE %s ATTACH PARTITION %s FOR VALUES FROM ('%s') TO ('%s')"
+        % (VOTE_TABLE, name, *(bound.isoformat() for bound in bounds)))
+
+
+def detach_vote_partitions(connection, before):
+    """
+    Detach the month partitions ending on or before `before`, recording
+    their vote counts in `ArchivedVoteCount` first. The detached tables are
+    kept for archival. Returns their names.
+    """
+    detached = []
+    with connection.cursor() as cursor, transaction.atomic(
+            using=connection.alias):
+        for month, name in sorted(vote_partitions(cursor).items()):
+            if next_month(month) > before:
+                continue
+            cursor.execute(
+                'INSERT INTO polls_archivedvotecount '
+                '(question_id, choice_id, partition, vote_count) '
+                'SELECT question_id, choice_id, %%s, count(*) FROM %s '
+                'WHERE deleted IS NULL GROUP BY question_id, choice_id'
+                % name, [name])
+            cursor.execute('ALTER TABLE %s DETACH PARTITION %s'
+                           % (VOTE_TABLE, name))
+            drop_id_default(cursor, name)
+            detached.append(name)
+    return detached
+
+
+def rebuild_vote_table(cursor, partition_by=None):
+    """
+    Recreate the vote table, partitioned by `partition_by` or plain, with
+    the same rows, indexes and foreign keys.
+    """
+    cursor.execute(
+        'SELECT pg_get_indexdef(indexrelid) FROM pg_index '
+        'WHERE indrelid = %s::regclass AND NOT indisprimary', [VOTE_TABLE])
+    index_definitions = [
+        definition.replace(' ON ONLY ', ' ON ')
+        for definition, in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype = 'f'", [VOTE_TABLE])
+    foreign_keys = cursor.fetchall()
+    cursor.execute('SELECT min("timestamp") FROM %s' % VOTE_TABLE)
+    first_timestamp = cursor.fetchone()[0]
+
+    old_table = VOTE_TABLE + '_old'
+    cursor.execute('ALTER TABLE %s RENAME TO %s' % (VOTE_TABLE, old_table))
+    cursor.execute(
+        'CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+        '%s' % (VOTE_TABLE, old_table,
+                ' PARTITION BY RANGE (%s)' % partition_by
+                if partition_by else ''))
+    drop_id_default(cursor, VOTE_TABLE)
+    if partition_by:
+        cursor.execute('CREATE TABLE %s PARTITION OF %s DEFAULT'
+                       % (DEFAULT_PARTITION, VOTE_TABLE))
+        month = month_start(first_timestamp or datetime.now(timezone.utc))
+        last_month = month_start(datetime.now(timezone.utc))
+        while month <= last_month:
+            create_partition(cursor, month)
+            month = next_month(month)
+    cursor.execute('INSERT INTO %s SELECT * FROM %s'
+                   % (VOTE_TABLE, old_table))
+    cursor.execute('DROP TABLE %s' % old_table)
+
+    # unique constraints of a partitioned table must hold the partition key
+    cursor.execute('ALTER TABLE %s ADD PRIMARY KEY (id%s)' % (
+        VOTE_TABLE, ', %s' % partition_by if partition_by else ''))
+    for definition in index_definitions:
+        cursor.execute(definition)
+    for name, definition in foreign_keys:
+        cursor.execute('ALTER TABLE %s ADD CONSTRAINT %s %s'
+                       % (VOTE_TABLE, name, definition))
+    sequence = VOTE_TABLE + '_id_seq'
+    cursor.execute('CREATE SEQUENCE %s OWNED BY %s.id'
+                   % (sequence, VOTE_TABLE))
+    cursor.execute(
+        "SELECT setval(%%s, coalesce(max(id), 0) + 1, false) FROM %s"
+        % VOTE_TABLE, [sequence])
+    cursor.execute("ALTER TABLE %s ALTER COLUMN id SET DEFAULT nextval('%s')"
+                   % (VOTE_TABLE, sequence))
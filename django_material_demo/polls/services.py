@@ -0,0 +1,584 @@
+import operator
+import random
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, defaultdict
+from datetime import timedelta
+from functools import reduce
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import caching
+from .models import (ArchivedVoteCount, BufferedVote, Choice, CustomChoice,
+                     Question, Vote, VoteBucket, VoteBucketCheckpoint,
+                     VoteCountShard, VoteSubmission)
+
+
+class RecentKeys(object):
+    """
+    Thread-safe, size-bounded set of keys which are forgotten after `ttl`
+    seconds, least recently added first.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            added = self._keys.get(key)
+            if added is None:
+                return False
+            if time.monotonic() - added > self.ttl:
+                del self._keys[key]
+                return False
+            return True
+
+    def add(self, key):
+        with self._lock:
+            self._keys[key] = time.monotonic()
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.max_size:
+                self._keys.popitem(last=False)
+
+
+TOP_CUSTOM_CHOICES = 10
+
+recent_submission_keys = RecentKeys(settings.VOTE_SUBMISSION_KEY_CACHE_SIZE,
+                                    settings.VOTE_SUBMISSION_KEY_TTL)
+
+
+def add_counts(queryset, field, counts):
+    """
+    Add `counts[pk]` to `field` of each row, issuing one UPDATE per distinct
+    amount rather than one per row.
+    """
+    pks_by_amount = defaultdict(list)
+    for pk, amount in counts.items():
+        pks_by_amount[amount].append(pk)
+    for amount, pks in pks_by_amount.items():
+        queryset.filter(pk__in=pks).update(**{field: F(field) + amount})
+
+
+def add_keyed_counts(queryset, field, key_fields, counts):
+    """
+    Like `add_counts`, for rows identified by their values of `key_fields`
+    rather than by pk.
+    """
+    keys_by_amount = defaultdict(list)
+    for key, amount in counts.items():
+        keys_by_amount[amount].append(key)
+    for amount, keys in keys_by_amount.items():
+        matches = reduce(operator.or_, (
+            Q(**dict(zip(key_fields, key))) for key in keys))
+        queryset.filter(matches).update(**{field: F(field) + amount})
+
+
+def record_vote(question, choice):
+    """
+    Record one vote for `choice` of `question`.
+
+    Counters are incremented by the database so concurrent voters never
+    overwrite each other's updates, and only the counter columns are written.
+    """
+    return submit_votes([Vote(question=question, choice=choice)])[0]
+
+
+def record_ballot(question, choice_ids, custom_choice_text='',
+                  idempotency_key=None):
+    """
+    Record one ballot of `question`: a vote for each of `choice_ids` plus a
+    custom vote if `custom_choice_text` is given, all sharing a ballot id.
+
+    Raises ValidationError if the ballot breaks the question's selection
+    rules. Costs the same number of queries however many choices are picked.
+    Returns the recorded votes, or an empty list if `idempotency_key` was
+    already used.
+    """
+    if idempotency_key is not None and len(idempotency_key) > 64:
+        raise ValidationError('Invalid idempotency key.')
+    if idempotency_key in recent_submission_keys:
+        return []
+
+    choice_ids = set(choice_ids)
+    custom_choice_text = ' '.join((custom_choice_text or '').split())
+    if custom_choice_text and not question.allow_custom:
+        raise ValidationError('Custom choices are not allowed.')
+
+    selection_count = len(choice_ids) + bool(custom_choice_text)
+    if not selection_count:
+        raise ValidationError("You didn't select a choice.")
+    if selection_count < question.min_selection:
+        raise ValidationError(
+            'Please select at least %(min)s choices.',
+            params={'min': question.min_selection})
+    if (question.max_selection is not None
+            and selection_count > question.max_selection):
+        raise ValidationError(
+            'Please select at most %(max)s choices.',
+            params={'max': question.max_selection})
+
+    valid_choices = question.choice_set.filter(pk__in=choice_ids)
+    if valid_choices.order_by().count() != len(choice_ids):
+        raise ValidationError("You didn't select a valid choice.")
+
+    ballot = uuid.uuid4()
+    timestamp = timezone.now()
+    votes = [Vote(question=question, choice_id=choice_id, ballot=ballot,
+                  timestamp=timestamp)
+             for choice_id in sorted(choice_ids)]
+    if custom_choice_text:
+        votes.append(Vote(question=question, is_custom=True,
+                          custom_choice_text=custom_choice_text,
+                          ballot=ballot, timestamp=timestamp))
+    if not idempotency_key:
+        return submit_votes(votes)
+    with transaction.atomic():
+        if not claim_submission_key(idempotency_key):
+            return []
+        return submit_votes(votes)
+
+
+def claim_submission_key(key):
+    """
+    Store a vote submission idempotency key. Returns False if it was
+    already used.
+    """
+    try:
+        with transaction.atomic():
+            VoteSubmission.objects.create(key=key)
+    except IntegrityError:
+        recent_submission_keys.add(key)
+        return False
+    transaction.on_commit(lambda: recent_submission_keys.add(key))
+    return True
+
+
+def submission_key_used(key):
+    """Whether a vote was already submitted with idempotency key `key`."""
+    return (key in recent_submission_keys
+            or VoteSubmission.objects.filter(key=key).exists())
+
+
+def prune_vote_submissions():
+    """Delete expired idempotency keys. Returns the number deleted."""
+    expired = timezone.now() - timedelta(
+        seconds=settings.VOTE_SUBMISSION_KEY_TTL)
+    deleted, _ = VoteSubmission.objects.filter(created__lt=expired).delete()
+    return deleted
+
+
+def submit_votes(votes):
+    """
+    Record unsaved `Vote` objects, or stage them for `flush_vote_buffer`
+    when `VOTE_BUFFER` is on.
+    """
+    if settings.VOTE_BUFFER:
+        return BufferedVote.objects.bulk_create(
+            [BufferedVote.from_vote(vote) for vote in votes])
+    return apply_votes(votes)
+
+
+def apply_votes(votes):
+    """
+    Insert unsaved `Vote` objects and add them to the vote counters, with
+    one grouped counter update per choice and question.
+    """
+    with transaction.atomic():
+        votes = Vote.objects.bulk_create(votes)
+        choice_counts = Counter(
+            vote.choice_id for vote in votes if vote.choice_id)
+        if settings.VOTE_COUNT_SHARDS:
+            # custom votes have no choice shard to hold them
+            question_counts = Counter(
+                vote.question_id for vote in votes if not vote.choice_id)
+        else:
+            question_counts = Counter(vote.question_id for vote in votes)
+        # counters are locked questions first, like everywhere else
+        add_counts(Question.objects, 'total_vote_count', question_counts)
+        if settings.VOTE_COUNT_SHARDS:
+            increment_vote_shards(choice_counts)
+        else:
+            add_counts(Choice.objects, 'vote_count', choice_counts)
+        count_custom_choices(votes)
+        question_ids = {vote.question_id for vote in votes}
+        transaction.on_commit(
+            lambda: caching.bump_results_version(question_ids))
+    return votes
+
+
+def count_custom_choices(votes):
+    """
+    Add custom votes to the `CustomChoice` of their text, creating missing
+    ones. Must be called inside a transaction.
+    """
+    texts = {}
+    counts = Counter()
+    for vote in votes:
+        if vote.is_custom and vote.custom_choice_text:
+            key = (vote.question_id,
+                   CustomChoice.hash_text(vote.custom_choice_text))
+            texts.setdefault(key, ' '.join(vote.custom_choice_text.split()))
+            counts[key] += 1
+    if not counts:
+        return
+
+    CustomChoice.objects.bulk_create(
+        [CustomChoice(question_id=question_id, text_hash=text_hash,
+                      text=texts[question_id, text_hash])
+         for question_id, text_hash in sorted(counts)],
+        ignore_conflicts=True)
+    add_keyed_counts(CustomChoice.objects, 'vote_count',
+                     ['question_id', 'text_hash'], counts)
+
+
+def count_vote_buckets(votes):
+    """
+    Add votes to the minute and hour `VoteBucket` of their choice, creating
+    missing ones. Must be called inside a transaction.
+    """
+    counts = Counter()
+    for vote in votes:
+        for resolution, start in VoteBucket.starts(vote.timestamp).items():
+            counts[vote.question_id, vote.choice_id, resolution, start] += 1
+
+    VoteBucket.objects.bulk_create(
+        [VoteBucket(question_id=question_id, choice_id=choice_id,
+                    resolution=resolution, start=start)
+         for question_id, choice_id, resolution, start in sorted(
+             counts, key=lambda key: (key[0], key[1] or 0, *key[2:]))],
+        ignore_conflicts=True)
+    add_keyed_counts(VoteBucket.objects, 'vote_count',
+                     ['question_id', 'choice_id', 'resolution', 'start'],
+                     counts)
+
+
+def count_new_vote_buckets(batch_size=5000, delay=None):
+    """
+    Add up to `batch_size` votes written since the last call to their
+    `VoteBucket`s, in pk order. Returns the number of votes counted.
+
+    Votes newer than `delay` seconds (`VOTE_BUCKET_DELAY` by default) are
+    left for a later call, as votes with lower ids may not be committed yet.
+    Kept out of `apply_votes` so voters never wait on the bucket rows.
+    """
+    if delay is None:
+        delay = settings.VOTE_BUCKET_DELAY
+    settled = timezone.now() - timedelta(seconds=delay)
+    with transaction.atomic():
+        checkpoint, _ = (VoteBucketCheckpoint.objects.select_for_update()
+                         .get_or_create(pk=1))
+        votes = []
+        for vote in (Vote.objects.filter(pk__gt=checkpoint.last_vote_id)
+                     .order_by('pk')
+                     .only('question', 'choice', 'timestamp')[:batch_size]):
+            if vote.timestamp > settled:
+                break
+            votes.append(vote)
+        if votes:
+            count_vote_buckets(votes)
+            checkpoint.last_vote_id = votes[-1].pk
+            checkpoint.save(update_fields=['last_vote_id'])
+    return len(votes)
+
+
+def rebuild_vote_buckets(batch_size=5000):
+    """
+    Recount all `VoteBucket` rows from the Vote table, `batch_size` votes at
+    a time. Yields the number of votes counted so far after each batch.
+    """
+    with transaction.atomic():
+        VoteBucket.objects.all().delete()
+        VoteBucketCheckpoint.objects.update_or_create(
+            pk=1, defaults={'last_vote_id': 0})
+    total = 0
+    while True:
+        count = count_new_vote_buckets(batch_size)
+        if not count:
+            break
+        total += count
+        yield total
+
+
+def vote_histogram(question, resolution=VoteBucket.Resolution.HOUR):
+    """
+    Return `(start, choice_id, vote_count)` of each bucket of `question`,
+    oldest first. Custom votes have no choice id.
+    """
+    return (question.vote_buckets
+            .filter(resolution=resolution)
+            .order_by('start', F('choice').asc(nulls_last=True))
+            .values_list('start', 'choice_id', 'vote_count'))
+
+
+def top_custom_choices(question, limit=TOP_CUSTOM_CHOICES):
+    """Return the `limit` most voted custom choices of `question`."""
+    return question.custom_choices.order_by('-vote_count', 'id')[:limit]
+
+
+def record_vote_batch(entries):
+    """
+    Validate and record a batch of `(question_id, choice_id)` votes, which
+    may span many questions, in one transaction.
+
+    Questions and choices are looked up with one query each. Buffered votes
+    count towards the questions' `max_vote_count`. Returns a list with an
+    error code, or None for each accepted vote, in entry order.
+    """
+    now = timezone.now()
+    errors = []
+    accepted = []
+    with transaction.atomic():
+        # FOR NO KEY UPDATE, so the foreign key checks of committing votes
+        # don't wait on the lock
+        locked = Question.objects.select_for_update(of=('self',),
+                                                    no_key=True)
+        questions = with_live_total_vote_count(locked.filter(
+            pk__in={question_id for question_id, _ in entries},
+            pub_date__lte=now).order_by())
+        questions = {question.pk: question for question in questions}
+        choices = Choice.objects.filter(
+            pk__in={choice_id for _, choice_id in entries}).order_by()
+        choice_questions = dict(choices.values_list('pk', 'question_id'))
+
+        # votes accepted by this batch, plus those still in the buffer
+        # which the counters don't hold yet
+        vote_counts = Counter()
+        capped_ids = [question.pk for question in questions.values()
+                      if question.has_max_vote_count]
+        if settings.VOTE_BUFFER and capped_ids:
+            vote_counts.update(dict(
+                BufferedVote.objects.filter(question__in=capped_ids)
+                .order_by().values_list('question')
+                .annotate(count=Count('pk'))))
+        for question_id, choice_id in entries:
+            question = questions.get(question_id)
+            if question is None:
+                error = 'question_not_found'
+            elif (now < question.vote_start
+                    or (question.vote_end and now > question.vote_end)):
+                error = 'voting_closed'
+            elif choice_questions.get(choice_id) != question_id:
+                error = 'invalid_choice'
+            elif (question.has_max_vote_count
+                    and question.max_vote_count is not None
+                    and (question.live_total_vote_count
+                         + vote_counts[question_id]
+                         >= question.max_vote_count)):
+                error = 'max_vote_count_reached'
+            else:
+                error = None
+                vote_counts[question_id] += 1
+                accepted.append((question_id, choice_id))
+            errors.append(error)
+
+        submit_votes([
+            Vote(question_id=question_id, choice_id=choice_id, timestamp=now)
+            for question_id, choice_id in accepted])
+    return errors
+
+
+def flush_vote_buffer(batch_size=None):
+    """
+    Move up to `batch_size` buffered votes into `Vote` and the counters.
+
+    Buffered rows are deleted in the same transaction that writes the votes,
+    so a crashed flush leaves them in place to be replayed by the next one.
+    Returns the number of votes flushed.
+    """
+    batch_size = batch_size or settings.VOTE_BUFFER_BATCH_SIZE
+    with transaction.atomic():
+        buffered = list(BufferedVote.objects
+                        .select_for_update(skip_locked=True)
+                        .order_by('pk')[:batch_size])
+        if buffered:
+            apply_votes([vote.to_vote() for vote in buffered])
+            BufferedVote.objects.filter(
+                pk__in=[vote.pk for vote in buffered]).delete()
+    return len(buffered)
+
+
+def increment_vote_shards(choice_counts):
+    """
+    Add `choice_counts[choice_id]` to one randomly picked shard, shared by
+    all the given choices. Must be called inside a transaction.
+    """
+    shard = random.randrange(settings.VOTE_COUNT_SHARDS)
+    choice_ids_by_amount = defaultdict(list)
+    for choice_id, amount in choice_counts.items():
+        choice_ids_by_amount[amount].append(choice_id)
+
+    for amount, choice_ids in choice_ids_by_amount.items():
+        shards = VoteCountShard.objects.filter(
+            choice_id__in=choice_ids, shard=shard)
+        savepoint = transaction.savepoint()
+        updated = shards.update(vote_count=F('vote_count') + amount)
+        if updated == len(choice_ids):
+            transaction.savepoint_commit(savepoint)
+            continue
+        # first votes landing on some of these shards
+        transaction.savepoint_rollback(savepoint)
+        VoteCountShard.objects.bulk_create(
+            [VoteCountShard(choice_id=choice_id, shard=shard)
+             for choice_id in choice_ids],
+            ignore_conflicts=True)
+        shards.update(vote_count=F('vote_count') + amount)
+
+
+def rollup_vote_shards():
+    """
+    Fold pending shard counts into `Choice.vote_count` and
+    `Question.total_vote_count`. Returns the number of votes rolled up.
+    """
+    with transaction.atomic():
+        pending = VoteCountShard.objects.filter(vote_count__gt=0).order_by()
+        question_ids = set(pending.values_list('choice__question_id',
+                                               flat=True))
+        # questions are locked before counters, as by `record_vote_batch`
+        list(Question.objects.select_for_update(no_key=True)
+             .filter(pk__in=question_ids).order_by('pk').values_list('pk'))
+        shards = (pending.select_for_update(of=('self',))
+                  .filter(choice__question__in=question_ids)
+                  .order_by('pk')
+                  .values_list('pk', 'choice_id', 'choice__question_id',
+                               'vote_count'))
+        choice_counts = Counter()
+        question_counts = Counter()
+        shard_pks = []
+        for pk, choice_id, question_id, vote_count in shards:
+            shard_pks.append(pk)
+            choice_counts[choice_id] += vote_count
+            question_counts[question_id] += vote_count
+
+        VoteCountShard.objects.filter(pk__in=shard_pks).update(vote_count=0)
+        add_counts(Choice.objects, 'vote_count', choice_counts)
+        add_counts(Question.objects, 'total_vote_count', question_counts)
+    return sum(choice_counts.values())
+
+
+def reconcile_vote_counts(min_question_id, max_question_id, dry_run=False):
+    """
+    Recount the votes of the questions with ids from `min_question_id` to
+    `max_question_id` and correct their counters, unless `dry_run`.
+
+    Counters are locked while counting, and the drift is added to them, so
+    votes written meanwhile are not lost. Returns `(model, pk, recorded,
+    counted)` for each counter that drifted.
+    """
+    drifts = []
+    with transaction.atomic():
+        # same lock order as `rollup_vote_shards` and `apply_votes`:
+        # questions, then shards and choices
+        questions = Question.objects.filter(
+            pk__range=(min_question_id, max_question_id)).order_by('pk')
+        list(questions.select_for_update(no_key=True).values_list('pk'))
+        if settings.VOTE_COUNT_SHARDS:
+            # shards created by votes meanwhile couldn't be locked
+            choice_ids = Choice.objects.filter(
+                question__gte=min_question_id,
+                question__lte=max_question_id).order_by('pk').values_list(
+                    'pk', flat=True)
+            VoteCountShard.objects.bulk_create(
+                [VoteCountShard(choice_id=choice_id, shard=shard)
+                 for choice_id in choice_ids
+                 for shard in range(settings.VOTE_COUNT_SHARDS)],
+                ignore_conflicts=True)
+            list(VoteCountShard.objects
+                 .select_for_update(of=('self',))
+                 .filter(choice__question__gte=min_question_id,
+                         choice__question__lte=max_question_id)
+                 .order_by('pk').values_list('pk'))
+        choices = with_live_vote_count(
+            Choice.objects.select_for_update(of=('self',), no_key=True)
+            .filter(question__gte=min_question_id,
+                    question__lte=max_question_id,
+                    question__deleted__isnull=True))
+        choices = list(choices.order_by('pk').values_list(
+            'pk', 'question_id', 'live_vote_count'))
+        choice_questions = {pk: question_id for pk, question_id, _ in choices}
+        choices = {pk: vote_count for pk, _, vote_count in choices}
+        # read once every counter is locked
+        questions = dict(with_live_total_vote_count(questions)
+                         .values_list('pk', 'live_total_vote_count'))
+
+        votes = Vote.objects.filter(
+            question__gte=min_question_id,
+            question__lte=max_question_id).order_by()
+        choice_counts = Counter(dict(
+            votes.filter(choice__isnull=False)
+            .values_list('choice').annotate(Count('pk'))))
+        question_counts = Counter(dict(
+            votes.values_list('question').annotate(Count('pk'))))
+        # votes in detached partitions
+        archived = ArchivedVoteCount.objects.filter(
+            question__gte=min_question_id,
+            question__lte=max_question_id).order_by()
+        choice_counts.update(dict(
+            archived.filter(choice__isnull=False)
+            .values_list('choice').annotate(Sum('vote_count'))))
+        question_counts.update(dict(
+            archived.values_list('question').annotate(Sum('vote_count'))))
+
+        for model, recorded_counts, counts, field in [
+                (Choice, choices, choice_counts, 'vote_count'),
+                (Question, questions, question_counts, 'total_vote_count')]:
+            drift = {}
+            for pk, recorded in recorded_counts.items():
+                counted = counts.get(pk, 0)
+                if counted != recorded:
+                    drift[pk] = counted - recorded
+                    drifts.append((model, pk, recorded, counted))
+            if not dry_run:
+                add_counts(model.objects, field, drift)
+
+        changed_question_ids = {
+            choice_questions[pk] if model is Choice else pk
+            for model, pk, _, _ in drifts}
+        if changed_question_ids and not dry_run:
+            Question.objects.filter(pk__in=changed_question_ids).update(
+                modified=timezone.now())
+            transaction.on_commit(
+                lambda: caching.bump_results_version(changed_question_ids))
+    return drifts
+
+
+def with_live_vote_count(choices):
+    """
+    Annotate `live_vote_count` on a Choice queryset, including votes still
+    held in counter shards.
+    """
+    if not settings.VOTE_COUNT_SHARDS:
+        return choices.annotate(live_vote_count=F('vote_count'))
+    pending = (VoteCountShard.objects
+               .filter(choice=OuterRef('pk'))
+               .values('choice')
+               .annotate(total=Sum('vote_count'))
+               .values('total'))
+    return choices.annotate(
+        live_vote_count=F('vote_count') + Coalesce(Subquery(pending), 0))
+
+
+def with_live_total_vote_count(questions):
+    """
+    Annotate `live_total_vote_count` on a Question queryset, including votes
+    still held in counter shards.
+    """
+    if not settings.VOTE_COUNT_SHARDS:
+        return questions.annotate(
+            live_total_vote_count=F('total_vote_count'))
+    pending = (VoteCountShard.objects
+               .filter(choice__question=OuterRef('pk'))
+               .values('choice__question')
+               .annotate(total=Sum('vote_count'))
+               .values('total'))
+    return questions.annotate(
+        live_total_vote_count=(F('total_vote_count')
+                               + Coalesce(Subquery(pending), 0)))
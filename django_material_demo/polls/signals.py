@@ -0,0 +1,38 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .caching import bump_latest_questions_version, bump_results_version
+from .models import Attachment, Choice, Question, Vote
+from .thumbnails import schedule_variants
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+    bump_results_version([instance.pk])
+    bump_latest_questions_version()
+
+
+@receiver(post_save, sender=Question)
+def thumbnail_changed(sender, instance, **kwargs):
+    if (instance.thumbnail and instance.thumbnail.name
+            != (instance.thumbnail_variants or {}).get('name')):
+        schedule_variants(instance)
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+@receiver(post_save, sender=Attachment)
+@receiver(post_delete, sender=Attachment)
+def choice_changed(sender, instance, **kwargs):
+    # choices and attachments are part of their question's public pages
+    Question.objects.filter(pk=instance.question_id).update(
+        modified=timezone.now())
+    bump_results_version([instance.question_id])
+
+
+@receiver(post_save, sender=Vote)
+@receiver(post_delete, sender=Vote)
+def question_results_changed(sender, instance, **kwargs):
+    bump_results_version([instance.question_id])
@@ -0,0 +1,29 @@
+"use strict";
+{
+  function init() {
+    let table = document.querySelector("table[data-results-stream]");
+    if (!table || !window.EventSource) {
+      return;
+    }
+    let source = new EventSource(table.dataset.resultsStream);
+    source.addEventListener("counts", function (e) {
+      let counts = JSON.parse(e.data);
+      for (let choiceId in counts) {
+        let cell = table.querySelector(`td[data-choice-id="${choiceId}"]`);
+        if (cell) {
+          cell.textContent = counts[choiceId];
+        }
+      }
+    });
+    // stop listening once the page is left
+    document.addEventListener("turbolinks:before-visit", function () {
+      source.close();
+    }, { once: true });
+  }
+
+  if (document.readyState === "loading") {
+    document.addEventListener("DOMContentLoaded", init, { once: true });
+  } else {
+    init();
+  }
+}
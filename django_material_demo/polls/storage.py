@@ -0,0 +1,345 @@
+import hashlib
+import os
+import posixpath
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import RequestDataTooBig
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db.models import F
+from django.urls import reverse
+from django.utils import timezone
+from storages.backends.s3boto3 import S3Boto3Storage
+
+URL_KEY = 'storage-url:%s'
+BLOB_PREFIX = 'blobs/'
+UPLOAD_PREFIX = 'uploads/'
+LOCAL_UPLOAD_SALT = 'polls.storage.local-upload'
+# most keys S3 lists or deletes in one request
+S3_PAGE_SIZE = 1000
+
+
+class URLCacheMixin(object):
+    """
+    Storage mixin keeping file URLs in the cache, so they are not signed
+    again on each page. Presigned URLs are kept until
+    `FILE_URL_CACHE_MARGIN` seconds before they expire, other URLs for
+    `FILE_URL_CACHE_TIMEOUT` seconds.
+    """
+
+    def url_cache_key(self, name):
+        cls = type(self)
+        source = '%s.%s:%s:%s:%s' % (
+            cls.__module__, cls.__qualname__,
+            getattr(self, 'bucket_name', ''), self.location, name)
+        return URL_KEY % hashlib.md5(source.encode(),
+                                     usedforsecurity=False).hexdigest()
+
+    def url_cache_timeout(self):
+        if getattr(self, 'querystring_auth', False):
+            return self.querystring_expire - settings.FILE_URL_CACHE_MARGIN
+        return settings.FILE_URL_CACHE_TIMEOUT
+
+    def url(self, name, *args, **kwargs):
+        if args or kwargs:
+            # URLs with custom parameters or expiry are not cached
+            return super().url(name, *args, **kwargs)
+        return self.urls([name])[name]
+
+    def urls(self, names):
+        """Return `{name: url}` of `names`, with one cache round trip."""
+        keys = {self.url_cache_key(name): name for name in names}
+        urls = {keys[key]: url
+                for key, url in cache.get_many(list(keys)).items()}
+        missing = {key: super(URLCacheMixin, self).url(name)
+                   for key, name in keys.items() if name not in urls}
+        timeout = self.url_cache_timeout()
+        if missing and timeout > 0:
+            cache.set_many(missing, timeout)
+        urls.update((keys[key], url) for key, url in missing.items())
+        return urls
+
+    def delete(self, name):
+        super().delete(name)
+        cache.delete(self.url_cache_key(name))
+
+
+class DirectUploadMixin(object):
+    """
+    Storage mixin issuing short-lived targets the browser uploads files to
+    directly, either whole or in parts. A target is a dict of the `method`,
+    `url` and `headers` of the request sending the file or part as its
+    body; the ETag of each part's response is needed to complete the
+    upload.
+    """
+
+    def upload_target(self, name, content_type):
+        raise NotImplementedError
+
+    def start_multipart_upload(self, name, content_type, part_count):
+        """Return the id of a new multipart upload and its part targets."""
+        raise NotImplementedError
+
+    def complete_multipart_upload(self, name, upload_id, etags):
+        raise NotImplementedError
+
+
+class S3Storage(URLCacheMixin, DirectUploadMixin, S3Boto3Storage):
+    def object_key(self, name):
+        return self._normalize_name(self._clean_name(name))
+
+    def presigned_url(self, method, **params):
+        return self.bucket.meta.client.generate_presigned_url(
+            method, Params={'Bucket': self.bucket_name, **params},
+            ExpiresIn=settings.DIRECT_UPLOAD_EXPIRE)
+
+    def upload_target(self, name, content_type):
+        return {
+            'method': 'PUT',
+            'url': self.presigned_url('put_object', Key=self.object_key(name),
+                                      ContentType=content_type),
+            'headers': {'Content-Type': content_type},
+        }
+
+    def start_multipart_upload(self, name, content_type, part_count):
+        key = self.object_key(name)
+        upload_id = self.bucket.meta.client.create_multipart_upload(
+            Bucket=self.bucket_name, Key=key,
+            ContentType=content_type)['UploadId']
+        return upload_id, [
+            {'method': 'PUT', 'headers': {},
+             'url': self.presigned_url('upload_part', Key=key,
+                                       UploadId=upload_id, PartNumber=part)}
+            for part in range(1, part_count + 1)]
+
+    def complete_multipart_upload(self, name, upload_id, etags):
+        self.bucket.meta.client.complete_multipart_upload(
+            Bucket=self.bucket_name, Key=self.object_key(name),
+            UploadId=upload_id, MultipartUpload={'Parts': [
+                {'ETag': etag, 'PartNumber': part}
+                for part, etag in enumerate(etags, 1)]})
+
+    def list_files(self, path):
+        """
+        Return the subdirectories of the directory `path` and the
+        `(name, size, modified)` of its files, with a request per page of
+        keys rather than per file.
+        """
+        prefix = self.object_key(path) if path else self.location
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        directories = []
+        files = []
+        paginator = self.bucket.meta.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix,
+                                       Delimiter='/'):
+            for entry in page.get('CommonPrefixes', ()):
+                directories.append(posixpath.join(
+                    path, posixpath.relpath(entry['Prefix'], prefix)))
+            for entry in page.get('Contents', ()):
+                if entry['Key'] != prefix:
+                    files.append((
+                        posixpath.join(
+                            path, posixpath.relpath(entry['Key'], prefix)),
+                        entry['Size'], entry['LastModified']))
+        return directories, files
+
+    def delete_many(self, names):
+        names = list(names)
+        for start in range(0, len(names), S3_PAGE_SIZE):
+            self.bucket.meta.client.delete_objects(
+                Bucket=self.bucket_name, Delete={'Quiet': True, 'Objects': [
+                    {'Key': self.object_key(name)}
+                    for name in names[start:start + S3_PAGE_SIZE]]})
+        cache.delete_many([self.url_cache_key(name) for name in names])
+
+
+class ChunkedContent(object):
+    """File content given as an iterable of chunks, read once."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+
+    def chunks(self, chunk_size=None):
+        return iter(self._chunks)
+
+
+class FileSystemUploadStorage(DirectUploadMixin, FileSystemStorage):
+    """
+    FileSystemStorage taking direct uploads through the `app_polls:upload`
+    view, a local stand-in for S3.
+    """
+
+    def target(self, **upload):
+        return {
+            'method': 'PUT',
+            'url': reverse('app_polls:upload', args=(signing.dumps(
+                upload, salt=LOCAL_UPLOAD_SALT),)),
+            'headers': {},
+        }
+
+    def upload_target(self, name, content_type):
+        return self.target(name=name)
+
+    def start_multipart_upload(self, name, content_type, part_count):
+        upload_id = uuid.uuid4().hex
+        return upload_id, [
+            self.target(name=name, upload_id=upload_id, part=part)
+            for part in range(1, part_count + 1)]
+
+    def part_name(self, name, upload_id, part):
+        return '%s.%s.part%s' % (name, upload_id, part)
+
+    def receive_upload(self, token, chunks):
+        """
+        Save the file or part sent to a target. Returns its ETag, raises
+        BadSignature for invalid or expired targets and RequestDataTooBig
+        for files larger than `DIRECT_UPLOAD_MAX_SIZE`, or parts larger
+        than `DIRECT_UPLOAD_PART_SIZE`.
+        """
+        upload = signing.loads(token, salt=LOCAL_UPLOAD_SALT,
+                               max_age=settings.DIRECT_UPLOAD_EXPIRE)
+        name = upload['name']
+        max_size = settings.DIRECT_UPLOAD_MAX_SIZE
+        if 'part' in upload:
+            name = self.part_name(name, upload['upload_id'], upload['part'])
+            max_size = settings.DIRECT_UPLOAD_PART_SIZE
+        digest = hashlib.md5(usedforsecurity=False)
+
+        def hashed(chunks):
+            size = 0
+            for chunk in chunks:
+                # checked before the chunk is written
+                size += len(chunk)
+                if size > max_size:
+                    raise RequestDataTooBig(
+                        'Upload larger than %s bytes.' % max_size)
+                digest.update(chunk)
+                yield chunk
+
+        self.delete(name)
+        try:
+            self.save(name, ChunkedContent(hashed(chunks)))
+        except RequestDataTooBig:
+            self.delete(name)
+            raise
+        return '"%s"' % digest.hexdigest()
+
+    def complete_multipart_upload(self, name, upload_id, etags):
+        parts = [self.part_name(name, upload_id, part)
+                 for part in range(1, len(etags) + 1)]
+        missing = [part for part in parts if not self.exists(part)]
+        if missing:
+            raise FileNotFoundError(missing[0])
+
+        def chunks():
+            for part in parts:
+                with self.open(part) as file:
+                    yield from file.chunks()
+
+        self.save(name, ChunkedContent(chunks()))
+        for part in parts:
+            self.delete(part)
+
+
+class ContentAddressedMixin(object):
+    """
+    Storage mixin saving each distinct content once, as a `Blob` named
+    `blobs/<sha256>/<file name>` and shared by every file with the same
+    content. Files uploaded through the `polls.uploads` upload handlers
+    come with their hash, so duplicates are never written. Direct uploads
+    are saved as they are.
+    """
+
+    def save(self, name, content, max_length=None):
+        from .models import Blob
+
+        if name is None:
+            name = content.name
+        if name.startswith(UPLOAD_PREFIX):
+            return super().save(name, content, max_length)
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        sha256 = getattr(content, 'sha256', None) or self.hash_content(content)
+        while True:
+            blob = Blob.objects.filter(sha256=sha256).first()
+            if blob is None:
+                blob_name = super().save(
+                    '%s%s/%s' % (BLOB_PREFIX, sha256, os.path.basename(name)),
+                    content, max_length)
+                blob, created = Blob.objects.get_or_create(
+                    sha256=sha256,
+                    defaults={'name': blob_name, 'size': content.size})
+                if not created and blob_name != blob.name:
+                    # saved concurrently; storages overwriting files may
+                    # have given both copies the same name
+                    self.delete_blob(blob_name)
+            # the blob may have just been swept
+            if Blob.objects.filter(pk=blob.pk).update(
+                    ref_count=F('ref_count') + 1, last_used=timezone.now()):
+                return blob.name
+
+    def hash_content(self, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def delete(self, name):
+        # blobs are shared, they are only deleted by `sweep_blobs`
+        if not name.startswith(BLOB_PREFIX):
+            super().delete(name)
+
+    def delete_blob(self, name):
+        super().delete(name)
+
+
+class ContentAddressedFileSystemStorage(ContentAddressedMixin,
+                                        FileSystemUploadStorage):
+    pass
+
+
+class ContentAddressedS3Storage(ContentAddressedMixin, S3Storage):
+    pass
+
+
+def list_files(storage, path):
+    """
+    Return the subdirectories of the directory `path` of `storage` and the
+    `(name, size, modified)` of its files, names relative to the root.
+    """
+    if hasattr(storage, 'list_files'):
+        return storage.list_files(path)
+    directories, files = storage.listdir(path)
+    files = [posixpath.join(path, name) for name in files]
+    return ([posixpath.join(path, name) for name in directories],
+            [(name, storage.size(name), storage.get_modified_time(name))
+             for name in files])
+
+
+def delete_files(storage, names):
+    """Delete the files `names` of `storage`, in bulk if it can."""
+    if hasattr(storage, 'delete_many'):
+        storage.delete_many(names)
+    else:
+        for name in names:
+            storage.delete(name)
+
+
+def storage_urls(storage, names):
+    """Return `{name: url}` of files of `storage`, in bulk if it can."""
+    if isinstance(storage, URLCacheMixin):
+        return storage.urls(names)
+    return {name: storage.url(name) for name in names}
+
+
+def file_urls(files):
+    """Return the URLs of `files`, `FieldFile`s of the same field."""
+    files = list(files)
+    if not files:
+        return []
+    urls = storage_urls(files[0].storage, [file.name for file in files])
+    return [urls[file.name] for file in files]
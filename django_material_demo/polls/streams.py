@@ -0,0 +1,240 @@
+"""
+Live vote counts for the results page, pushed as server-sent events.
+
+One `ResultsNotifier` per process polls the counts of every question that
+somebody is watching, with a single query per interval, and fans the
+changed counts out to the subscriptions of each question.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from django.urls import Resolver404, resolve
+
+from .models import Choice, Question
+from .services import with_live_vote_count
+
+logger = logging.getLogger(__name__)
+
+# seconds between comments keeping idle connections open
+KEEPALIVE_INTERVAL = 15
+# seconds a stream served by a sync worker is kept open; the browser then
+# reconnects, so that a WSGI worker is never held for good
+SYNC_STREAM_LIFETIME = 60
+
+
+class Subscription(object):
+    """Changed vote counts of one question, waiting to be sent to a client."""
+
+    def __init__(self, question_id):
+        self.question_id = question_id
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+
+    def push(self, counts):
+        with self._lock:
+            self._counts.update(counts)
+        self.wake()
+
+    def pop(self):
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        return counts
+
+    def wake(self):
+        self._event.set()
+
+    def wait(self, timeout):
+        self._event.wait(timeout)
+        self._event.clear()
+
+
+class AsyncSubscription(Subscription):
+    def __init__(self, question_id):
+        super().__init__(question_id)
+        self._loop = asyncio.get_running_loop()
+        self._async_event = asyncio.Event()
+
+    def wake(self):
+        # called from the notifier thread
+        self._loop.call_soon_threadsafe(self._async_event.set)
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._async_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._async_event.clear()
+
+
+class ResultsNotifier(object):
+    def __init__(self, interval):
+        self.interval = interval
+        self._subscriptions = defaultdict(set)
+        # last polled counts, by question id then choice id
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, subscription):
+        with self._lock:
+            self._subscriptions[subscription.question_id].add(subscription)
+            counts = self._counts.get(subscription.question_id)
+            if counts:
+                subscription.push(counts)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self.run, name='results-notifier', daemon=True)
+                self._thread.start()
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions[subscription.question_id]
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.question_id]
+                self._counts.pop(subscription.question_id, None)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                question_ids = list(self._subscriptions)
+            if not question_ids:
+                continue
+            close_old_connections()
+            try:
+                self.poll(question_ids)
+            except DatabaseError:
+                logger.exception('Failed to poll vote counts')
+
+    def poll(self, question_ids):
+        choices = with_live_vote_count(
+            Choice.objects.filter(question_id__in=question_ids).order_by())
+        latest = defaultdict(dict)
+        for question_id, choice_id, count in choices.values_list(
+                'question_id', 'pk', 'live_vote_count'):
+            latest[question_id][choice_id] = count
+
+        with self._lock:
+            for question_id in question_ids:
+                subscriptions = self._subscriptions.get(question_id)
+                if not subscriptions:
+                    continue
+                counts = latest[question_id]
+                previous = self._counts.get(question_id, {})
+                changed = {choice_id: count
+                           for choice_id, count in counts.items()
+                           if previous.get(choice_id) != count}
+                self._counts[question_id] = counts
+                if changed:
+                    for subscription in subscriptions:
+                        subscription.push(changed)
+
+
+notifier = ResultsNotifier(settings.POLLS_RESULTS_STREAM_INTERVAL)
+
+
+def next_message(question, subscription):
+    # counts wait in the subscription until the question allows showing them
+    if question.can_show_votes():
+        counts = subscription.pop()
+        if counts:
+            return 'event: counts\ndata: %s\n\n' % json.dumps(counts)
+    return ': keepalive\n\n'
+
+
+def event_stream(question, lifetime=SYNC_STREAM_LIFETIME):
+    """
+    Server-sent events with the changed vote counts of `question`, ending
+    after `lifetime` seconds.
+    """
+    deadline = time.monotonic() + lifetime
+    subscription = Subscription(question.pk)
+    notifier.subscribe(subscription)
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            subscription.wait(min(KEEPALIVE_INTERVAL, remaining))
+            yield next_message(question, subscription)
+    finally:
+        notifier.unsubscribe(subscription)
+
+
+class ResultsStreamRouter(object):
+    """
+    ASGI application serving the results stream natively, without holding
+    a thread per client, and passing any other request to `application`.
+
+    Django 4.1 iterates streaming responses synchronously on the event loop,
+    so the stream can't be served by a Django view under ASGI. These
+    requests skip the Django middleware; the stream only carries public
+    vote counts.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'].endswith('/stream/'):
+            try:
+                match = resolve(scope['path'])
+            except Resolver404:
+                match = None
+            if match and match.view_name == 'app_polls:results_stream':
+                return await self.stream(match.kwargs['pk'], receive, send)
+        return await self.application(scope, receive, send)
+
+    async def stream(self, pk, receive, send):
+        question = await Question.objects.filter(pk=pk).afirst()
+        await sync_to_async(close_old_connections)()
+        if question is None:
+            return await self.respond(send, 404)
+        if question.show_vote == Question.ShowVote.NEVER:
+            return await self.respond(send, 204)
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream'),
+                        (b'cache-control', b'no-cache'),
+                        (b'x-accel-buffering', b'no')],
+        })
+        disconnected = asyncio.ensure_future(self.wait_disconnect(receive))
+        subscription = AsyncSubscription(question.pk)
+        notifier.subscribe(subscription)
+        try:
+            while not disconnected.done():
+                waiting = asyncio.ensure_future(
+                    subscription.wait(KEEPALIVE_INTERVAL))
+                await asyncio.wait([waiting, disconnected],
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    waiting.cancel()
+                    break
+                await send({
+                    'type': 'http.response.body',
+                    'body': next_message(question, subscription).encode(),
+                    'more_body': True,
+                })
+        finally:
+            notifier.unsubscribe(subscription)
+            disconnected.cancel()
+
+    async def respond(self, send, status):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def wait_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
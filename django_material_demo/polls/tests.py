@@ -1,10 +1,38 @@
 import datetime
+import json
+import os
+import re
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+from urllib.parse import urlencode
 
-from django.test import TestCase
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadhandler import StopFutureHandlers
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.loader import MigrationLoader
+from django.http import Http404
+from django.test import (AsyncRequestFactory, Client, TestCase,
+                         TransactionTestCase, override_settings)
 from django.utils import timezone
 from django.urls import reverse
+from PIL import Image
 
-from .models import Question
+from . import (archive, async_views, caching, partitions, services,
+               streams, thumbnails, uploads)
+from .models import (ArchivedVoteCount, Attachment, Blob, BufferedVote,
+                     Choice, CustomChoice, Question, User as PollsUser,
+                     Vote, VoteBucket, VoteCountShard)
+from .storage import ContentAddressedMixin, URLCacheMixin
 
 
 class QuestionModelTests(TestCase):
@@ -38,6 +66,22 @@ class QuestionModelTests(TestCase):
         recent_question = Question(pub_date=time)
         self.assertIs(recent_question.was_published_recently(), True)
 
+    def test_choice_lists(self):
+        """
+        choice_lists() returns the choice_list() of many questions with one
+        query.
+        """
+        questions = [create_question('Question %s' % i, days=-1)
+                     for i in range(3)]
+        for text in ('b', 'a'):
+            questions[0].choice_set.create(choice_text=text)
+        questions[1].choice_set.create(choice_text='c')
+        with self.assertNumQueries(1):
+            choice_lists = Question.choice_lists(questions)
+        self.assertEqual(choice_lists, {
+            question.pk: question.choice_list() for question in questions})
+        self.assertEqual(choice_lists[questions[0].pk], ['a', 'b'])
+
 
 def create_question(question_text, days):
     """
@@ -49,6 +93,39 @@ def create_question(question_text, days):
     return Question.objects.create(question_text=question_text, pub_date=time)
 
 
+class CMSQuestionListTests(TestCase):
+    def setUp(self):
+        account = User.objects.create_superuser('admin', 'admin@example.com',
+                                                'password')
+        self.creator = PollsUser.objects.create(account=account)
+        self.client.force_login(account)
+
+    def get_page(self):
+        return self.client.get(
+            reverse('polls:question_list'),
+            {'datatable-draw': 1, 'datatable-start': 0,
+             'datatable-length': 50},
+            HTTP_DATATABLE='true')
+
+    def add_questions(self, count):
+        for i in range(count):
+            question = create_question('Question %s' % i, days=-1)
+            question.creator = self.creator
+            question.save()
+            for text in ('a', 'b'):
+                question.choice_set.create(choice_text=text)
+
+    def test_page_queries_do_not_grow_with_rows(self):
+        # the frontend module registry is loaded by the first request only
+        self.get_page()
+        self.add_questions(3)
+        with self.assertNumQueries(6):
+            self.assertEqual(len(self.get_page().json()['data']), 3)
+        self.add_questions(27)
+        with self.assertNumQueries(6):
+            self.assertEqual(len(self.get_page().json()['data']), 30)
+
+
 class QuestionIndexViewTests(TestCase):
     def test_no_questions(self):
         """
@@ -129,3 +206,1271 @@ class QuestionDetailViewTests(TestCase):
         url = reverse('app_polls:detail', args=(past_question.id,))
         response = self.client.get(url)
         self.assertContains(response, past_question.question_text)
+
+
+class RecordVoteTests(TransactionTestCase):
+    def test_concurrent_votes_are_all_counted(self):
+        """
+        Counters stay equal to the number of Vote rows when many votes are
+        recorded in parallel.
+        """
+        question = create_question(question_text='Busy question.', days=-1)
+        choices = [Choice.objects.create(question=question, choice_text=text)
+                   for text in ('A', 'B', 'C')]
+
+        def vote(i):
+            try:
+                services.record_vote(question, choices[i % len(choices)])
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(executor.map(vote, range(2000)))
+
+        question.refresh_from_db()
+        vote_count = Vote.objects.count()
+        self.assertEqual(vote_count, 2000)
+        self.assertEqual(question.total_vote_count, vote_count)
+        self.assertEqual(
+            sum(Choice.objects.values_list('vote_count', flat=True)),
+            vote_count)
+
+
+    @override_settings(VOTE_COUNT_SHARDS=4)
+    def test_concurrent_batches_and_rollups(self):
+        """
+        Batches, single votes, shard rollups and reconciliations running
+        together take their locks in the same order, so none deadlocks.
+        """
+        question = create_question(question_text='Capped.', days=-1)
+        question.has_max_vote_count = True
+        question.max_vote_count = 1000
+        question.save()
+        choices = [Choice.objects.create(question=question, choice_text=text)
+                   for text in ('A', 'B')]
+        batch = [(question.pk, choice.pk) for choice in choices]
+
+        def work(i):
+            try:
+                if i % 10 == 0:
+                    services.rollup_vote_shards()
+                elif i % 10 == 5:
+                    services.reconcile_vote_counts(question.pk, question.pk)
+                elif i % 2:
+                    services.record_vote_batch(batch)
+                else:
+                    services.record_vote(question, choices[i % 4 // 2])
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(executor.map(work, range(600)))
+        services.rollup_vote_shards()
+
+        question.refresh_from_db()
+        self.assertEqual(question.total_vote_count, Vote.objects.count())
+
+
+@override_settings(VOTE_COUNT_SHARDS=4)
+class ShardedVoteCountTests(TestCase):
+    def setUp(self):
+        self.question = create_question(question_text='Hot question.', days=-1)
+        self.choice = Choice.objects.create(
+            question=self.question, choice_text='A')
+        for _ in range(10):
+            services.record_vote(self.question, self.choice)
+
+    def test_votes_are_held_in_shards(self):
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.vote_count, 0)
+        self.assertLessEqual(VoteCountShard.objects.count(), 4)
+        choice = services.with_live_vote_count(Choice.objects.all()).get()
+        self.assertEqual(choice.live_vote_count, 10)
+        question = services.with_live_total_vote_count(
+            Question.objects.all()).get()
+        self.assertEqual(question.live_total_vote_count, 10)
+
+    def test_rollup_folds_shards_into_counters(self):
+        self.assertEqual(services.rollup_vote_shards(), 10)
+        self.choice.refresh_from_db()
+        self.question.refresh_from_db()
+        self.assertEqual(self.choice.vote_count, 10)
+        self.assertEqual(self.question.total_vote_count, 10)
+        choice = services.with_live_vote_count(Choice.objects.all()).get()
+        self.assertEqual(choice.live_vote_count, 10)
+
+
+@override_settings(VOTE_BUFFER=True)
+class BufferedVoteTests(TestCase):
+    def test_flush_writes_buffered_votes(self):
+        question = create_question(question_text='Spiky question.', days=-1)
+        choice_a = Choice.objects.create(question=question, choice_text='A')
+        choice_b = Choice.objects.create(question=question, choice_text='B')
+        for choice in (choice_a, choice_a, choice_b):
+            services.record_vote(question, choice)
+        self.assertEqual(Vote.objects.count(), 0)
+
+        self.assertEqual(services.flush_vote_buffer(batch_size=2), 2)
+        self.assertEqual(services.flush_vote_buffer(batch_size=2), 1)
+        self.assertEqual(services.flush_vote_buffer(batch_size=2), 0)
+
+        question.refresh_from_db()
+        self.assertFalse(BufferedVote.objects.exists())
+        self.assertEqual(Vote.objects.count(), 3)
+        self.assertEqual(question.total_vote_count, 3)
+        self.assertEqual(
+            list(Choice.objects.values_list('vote_count', flat=True)), [2, 1])
+
+
+class BatchVoteViewTests(TestCase):
+    def post_votes(self, votes):
+        return self.client.post(reverse('app_polls:batch_vote'),
+                                json.dumps(votes),
+                                content_type='application/json')
+
+    def test_batch_across_questions(self):
+        """
+        Valid votes are recorded and invalid ones get an error status, in
+        a constant number of queries.
+        """
+        open_question = create_question(question_text='Open.', days=-1)
+        open_choice = Choice.objects.create(
+            question=open_question, choice_text='A')
+        capped_question = create_question(question_text='Capped.', days=-1)
+        capped_question.has_max_vote_count = True
+        capped_question.max_vote_count = 1
+        capped_question.save()
+        capped_choice = Choice.objects.create(
+            question=capped_question, choice_text='B')
+        closed_question = create_question(question_text='Closed.', days=-1)
+        closed_question.vote_end = timezone.now()
+        closed_question.save()
+        closed_choice = Choice.objects.create(
+            question=closed_question, choice_text='C')
+
+        with self.assertNumQueries(9):
+            response = self.post_votes([
+                {'question': open_question.pk, 'choice': open_choice.pk},
+                {'question': open_question.pk, 'choice': capped_choice.pk},
+                {'question': capped_question.pk, 'choice': capped_choice.pk},
+                {'question': capped_question.pk, 'choice': capped_choice.pk},
+                {'question': closed_question.pk, 'choice': closed_choice.pk},
+                {'question': 0, 'choice': open_choice.pk},
+            ])
+        self.assertEqual(response.json()['results'], [
+            {'status': 'ok'},
+            {'status': 'error', 'error': 'invalid_choice'},
+            {'status': 'ok'},
+            {'status': 'error', 'error': 'max_vote_count_reached'},
+            {'status': 'error', 'error': 'voting_closed'},
+            {'status': 'error', 'error': 'question_not_found'},
+        ])
+        self.assertEqual(Vote.objects.count(), 2)
+        open_question.refresh_from_db()
+        self.assertEqual(open_question.total_vote_count, 1)
+
+    @override_settings(VOTE_BUFFER=True)
+    def test_buffered_votes_count_towards_cap(self):
+        question = create_question(question_text='Capped.', days=-1)
+        question.has_max_vote_count = True
+        question.max_vote_count = 2
+        question.save()
+        choice = Choice.objects.create(question=question, choice_text='A')
+        services.record_vote(question, choice)
+
+        response = self.post_votes(
+            [{'question': question.pk, 'choice': choice.pk}] * 2)
+        self.assertEqual(response.json()['results'], [
+            {'status': 'ok'},
+            {'status': 'error', 'error': 'max_vote_count_reached'},
+        ])
+        self.assertEqual(BufferedVote.objects.count(), 2)
+
+    def test_malformed_batch(self):
+        response = self.post_votes({'question': 1})
+        self.assertEqual(response.status_code, 400)
+
+
+class BallotTests(TestCase):
+    def setUp(self):
+        self.question = create_question(question_text='Pick some.', days=-1)
+        self.question.min_selection = 2
+        self.question.max_selection = 4
+        self.question.allow_custom = True
+        self.question.save()
+        self.choices = [
+            Choice.objects.create(question=self.question, choice_text=text)
+            for text in ('A', 'B', 'C', 'D', 'E')]
+
+    def vote(self, choices, custom_choice=''):
+        return self.client.post(
+            reverse('app_polls:vote', args=(self.question.pk,)),
+            {'choice': [choice.pk for choice in choices],
+             'custom_choice': custom_choice})
+
+    def test_ballot_queries_do_not_grow_with_selection(self):
+        with self.assertNumQueries(7):
+            self.vote(self.choices[:2])
+        # plus the custom choice count upsert
+        with self.assertNumQueries(9):
+            self.vote(self.choices[:3], custom_choice='  Something   else ')
+
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.total_vote_count, 6)
+        self.assertEqual(Vote.objects.values('ballot').distinct().count(), 2)
+        self.assertEqual(
+            Vote.objects.get(is_custom=True).custom_choice_text,
+            'Something else')
+        self.assertEqual(
+            list(Choice.objects.values_list('vote_count', flat=True)),
+            [2, 2, 1, 0, 0])
+
+    def test_selection_bounds(self):
+        response = self.vote(self.choices[:1])
+        self.assertContains(response, 'Please select at least 2 choices.')
+        response = self.vote(self.choices, custom_choice='F')
+        self.assertContains(response, 'Please select at most 4 choices.')
+        other = create_question(question_text='Other.', days=-1)
+        other_choice = Choice.objects.create(question=other, choice_text='X')
+        response = self.vote([self.choices[0], other_choice])
+        self.assertContains(response, "You didn&#x27;t select a valid choice.")
+        self.assertFalse(Vote.objects.exists())
+
+
+class IdempotentVoteTests(TestCase):
+    def setUp(self):
+        self.question = create_question(question_text='Retry.', days=-1)
+        self.question.max_selection = 1
+        self.question.save()
+        self.choice = Choice.objects.create(
+            question=self.question, choice_text='A')
+        self.url = reverse('app_polls:vote', args=(self.question.pk,))
+        recent_keys = mock.patch.object(
+            services, 'recent_submission_keys', services.RecentKeys(10, 60))
+        recent_keys.start()
+        self.addCleanup(recent_keys.stop)
+
+    def test_retried_form_is_counted_once(self):
+        data = {'choice': self.choice.pk, 'idempotency_key': 'form-key'}
+        for _ in range(3):
+            response = self.client.post(self.url, data)
+            self.assertRedirects(
+                response, reverse('app_polls:results',
+                                  args=(self.question.pk,)))
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.vote_count, 1)
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_duplicate_header_key_stored_in_database(self):
+        data = {'choice': self.choice.pk}
+        self.client.post(self.url, data, HTTP_IDEMPOTENCY_KEY='header-key')
+        # a process which hasn't seen the key yet falls back to the database
+        with mock.patch.object(services, 'recent_submission_keys',
+                               services.RecentKeys(10, 60)):
+            self.client.post(self.url, data,
+                             HTTP_IDEMPOTENCY_KEY='header-key')
+            self.client.post(self.url, data, HTTP_IDEMPOTENCY_KEY='other-key')
+        self.choice.refresh_from_db()
+        self.assertEqual(self.choice.vote_count, 2)
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        self.question = create_question(question_text='Async.', days=-1)
+        self.question.max_selection = 1
+        self.question.save()
+        self.choice = Choice.objects.create(
+            question=self.question, choice_text='Choice A')
+
+    def request(self, method, path, data=None):
+        if method == 'post':
+            request = self.factory.post(
+                path, urlencode(data),
+                content_type='application/x-www-form-urlencoded')
+        else:
+            request = self.factory.get(path)
+        request.user = AnonymousUser()
+        request.session = SessionStore()
+        return request
+
+    async def test_question_and_results(self):
+        view = async_views.QuestionView.as_view()
+        response = await view(self.request('get', '/'), pk=self.question.pk)
+        self.assertContains(response, 'Choice A')
+
+        response = await async_views.vote(
+            self.request('post', '/', {'choice': self.choice.pk}),
+            question_id=self.question.pk)
+        self.assertEqual(response.status_code, 302)
+
+        view = async_views.ResultsView.as_view()
+        response = await view(self.request('get', '/'), pk=self.question.pk)
+        self.assertContains(
+            response, '<td data-choice-id="%s">1</td>' % self.choice.pk,
+            html=True)
+
+    async def test_future_question(self):
+        future_question = await Question.objects.acreate(
+            question_text='Future.',
+            pub_date=timezone.now() + datetime.timedelta(days=1))
+        view = async_views.QuestionView.as_view()
+        with self.assertRaises(Http404):
+            await view(self.request('get', '/'), pk=future_question.pk)
+
+
+class ResultsStreamTests(TestCase):
+    def setUp(self):
+        self.question = create_question(question_text='Live.', days=-1)
+        self.choice = Choice.objects.create(
+            question=self.question, choice_text='A')
+        self.notifier = streams.ResultsNotifier(interval=1)
+
+    def test_notifier_pushes_changed_counts(self):
+        first = streams.Subscription(self.question.pk)
+        second = streams.Subscription(self.question.pk)
+        self.notifier._subscriptions[self.question.pk].update([first, second])
+        with self.assertNumQueries(1):
+            self.notifier.poll([self.question.pk])
+        self.assertEqual(first.pop(), {self.choice.pk: 0})
+        self.assertEqual(second.pop(), {self.choice.pk: 0})
+
+        self.notifier.poll([self.question.pk])
+        self.assertEqual(first.pop(), {})
+        services.record_vote(self.question, self.choice)
+        self.notifier.poll([self.question.pk])
+        self.assertEqual(first.pop(), {self.choice.pk: 1})
+
+    def test_counts_held_until_vote_end(self):
+        self.question.show_vote = Question.ShowVote.END
+        self.question.vote_end = timezone.now() + datetime.timedelta(days=1)
+        subscription = streams.Subscription(self.question.pk)
+        subscription.push({self.choice.pk: 3})
+        self.assertEqual(
+            streams.next_message(self.question, subscription),
+            ': keepalive\n\n')
+        self.question.vote_end = timezone.now()
+        self.assertEqual(
+            streams.next_message(self.question, subscription),
+            'event: counts\ndata: {"%s": 3}\n\n' % self.choice.pk)
+
+    def test_sync_stream_ends(self):
+        with mock.patch.object(streams, 'notifier') as notifier:
+            messages = list(streams.event_stream(self.question, lifetime=0.1))
+        self.assertTrue(messages)
+        notifier.unsubscribe.assert_called_once()
+
+    def test_stream_opened_under_asgi_only(self):
+        url = reverse('app_polls:results', args=(self.question.pk,))
+        self.assertNotContains(self.client.get(url), 'data-results-stream')
+        with override_settings(POLLS_ASYNC_VIEWS=True):
+            self.assertContains(self.client.get(url), 'data-results-stream')
+
+    def test_never_shown_question_is_not_streamed(self):
+        self.question.show_vote = Question.ShowVote.NEVER
+        self.question.save()
+        response = self.client.get(
+            reverse('app_polls:results_stream', args=(self.question.pk,)))
+        self.assertEqual(response.status_code, 204)
+
+
+class ResultsCacheTests(TestCase):
+    def setUp(self):
+        self.question = create_question(question_text='Cached.', days=-1)
+        self.choice = Choice.objects.create(
+            question=self.question, choice_text='A')
+        self.url = reverse('app_polls:results', args=(self.question.pk,))
+
+    def assertVoteCount(self, count):
+        response = self.client.get(self.url)
+        self.assertContains(
+            response, '<td data-choice-id="%s">%s</td>' % (
+                self.choice.pk, count),
+            html=True)
+
+    def test_rows_cached_until_vote(self):
+        rows = caching.results_rows(self.question)
+        with self.assertNumQueries(0):
+            self.assertEqual(caching.results_rows(self.question), rows)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            services.record_vote(self.question, self.choice)
+        self.assertVoteCount(1)
+
+    def test_choice_edit_invalidates_rows(self):
+        self.assertVoteCount(0)
+        self.choice.vote_count = 5
+        self.choice.save()
+        self.assertVoteCount(5)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.question = create_question(question_text='Fresh?', days=-1)
+        self.choice = Choice.objects.create(
+            question=self.question, choice_text='A')
+        # pick up the CSRF cookie, which is part of the ETag
+        self.client.get(reverse('app_polls:home'))
+
+    def test_results_not_modified(self):
+        url = reverse('app_polls:results', args=(self.question.pk,))
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        services.record_vote(self.question, self.choice)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_question_stale_once_its_key_is_used(self):
+        url = reverse('app_polls:question', args=(self.question.pk,))
+        response = self.client.get(url)
+        etag = response['ETag']
+        key = response.context['idempotency_key']
+        self.assertIn(key, etag)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.client.post(
+            reverse('app_polls:vote', args=(self.question.pk,)),
+            {'choice': self.choice.pk, 'idempotency_key': key})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.context['idempotency_key'], key)
+
+
+class CustomChoiceTests(TestCase):
+    def setUp(self):
+        self.question = create_question(question_text='Anything?', days=-1)
+        self.question.min_selection = 0
+        self.question.allow_custom = True
+        self.question.save()
+
+    def test_custom_votes_grouped_by_folded_text(self):
+        for text in ['Blue', ' blue  ', 'BLUE', 'Green tea', 'green  TEA',
+                     'Red']:
+            services.record_ballot(self.question, [], custom_choice_text=text)
+        self.assertEqual(
+            [(custom_choice.text, custom_choice.vote_count)
+             for custom_choice in services.top_custom_choices(
+                 self.question, limit=2)],
+            [('Blue', 3), ('Green tea', 2)])
+        self.assertEqual(CustomChoice.objects.count(), 3)
+
+    def test_results_list_custom_choices(self):
+        services.record_ballot(self.question, [], custom_choice_text='Mine')
+        response = self.client.get(
+            reverse('app_polls:results', args=(self.question.pk,)))
+        self.assertContains(response, 'Mine')
+
+
+@override_settings(VOTE_BUCKET_DELAY=0)
+class VoteBucketTests(TestCase):
+    def setUp(self):
+        self.question = create_question(question_text='Over time.', days=-1)
+        self.choice = Choice.objects.create(
+            question=self.question, choice_text='A')
+
+    def test_buckets_follow_votes(self):
+        now = timezone.now().replace(minute=30)
+        services.apply_votes([
+            Vote(question=self.question, choice=self.choice, timestamp=now),
+            Vote(question=self.question, choice=self.choice,
+                 timestamp=now + datetime.timedelta(minutes=1)),
+            Vote(question=self.question, is_custom=True,
+                 custom_choice_text='B', timestamp=now)])
+        self.assertFalse(VoteBucket.objects.exists())
+        self.assertEqual(services.count_new_vote_buckets(), 3)
+        self.assertEqual(services.count_new_vote_buckets(), 0)
+        hour = now.replace(minute=0, second=0, microsecond=0)
+        self.assertEqual(
+            list(services.vote_histogram(self.question)),
+            [(hour, self.choice.pk, 2), (hour, None, 1)])
+        minutes = services.vote_histogram(
+            self.question, VoteBucket.Resolution.MINUTE)
+        self.assertEqual(len(minutes), 3)
+
+    def test_recent_votes_wait(self):
+        services.record_vote(self.question, self.choice)
+        with override_settings(VOTE_BUCKET_DELAY=60):
+            self.assertEqual(services.count_new_vote_buckets(), 0)
+        self.assertEqual(services.count_new_vote_buckets(), 1)
+
+    def test_rebuild(self):
+        for _ in range(5):
+            services.record_vote(self.question, self.choice)
+        services.count_new_vote_buckets()
+        expected = list(services.vote_histogram(self.question))
+        VoteBucket.objects.update(vote_count=0)
+        self.assertEqual(
+            list(services.rebuild_vote_buckets(batch_size=2)), [2, 4, 5])
+        self.assertEqual(list(services.vote_histogram(self.question)),
+                         expected)
+
+
+class ReconcileVotesTests(TestCase):
+    def setUp(self):
+        self.question = create_question(question_text='Drifted.', days=-1)
+        self.choices = [
+            Choice.objects.create(question=self.question, choice_text=text)
+            for text in ('A', 'B')]
+        services.record_vote(self.question, self.choices[0])
+        services.record_vote(self.question, self.choices[1])
+        Choice.objects.filter(pk=self.choices[0].pk).update(vote_count=5)
+        Question.objects.filter(pk=self.question.pk).update(
+            total_vote_count=0)
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command('reconcile_votes', dry_run=True, workers=1, stdout=out)
+        self.assertIn('Choice #%s: recorded 5, counted 1' % (
+            self.choices[0].pk), out.getvalue())
+        self.assertIn('Found 2 counter(s).', out.getvalue())
+        self.assertEqual(
+            Choice.objects.get(pk=self.choices[0].pk).vote_count, 5)
+
+    def test_archived_votes_counted(self):
+        ArchivedVoteCount.objects.create(
+            question=self.question, choice=self.choices[0],
+            partition='polls_vote_p2020_01', vote_count=4)
+        call_command('reconcile_votes', workers=1, stdout=StringIO())
+        self.assertEqual(
+            Choice.objects.get(pk=self.choices[0].pk).vote_count, 5)
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.total_vote_count, 6)
+
+    def test_counters_corrected(self):
+        call_command('reconcile_votes', workers=1, stdout=StringIO())
+        self.assertEqual(
+            list(Choice.objects.values_list('vote_count', flat=True)),
+            [1, 1])
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.total_vote_count, 2)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'requires PostgreSQL')
+class VotePartitionTests(TestCase):
+    def test_detached_votes_archived(self):
+        question = create_question(question_text='Old.', days=-1)
+        choice = Choice.objects.create(question=question, choice_text='A')
+        this_month = partitions.month_start(timezone.now())
+        old_month = partitions.previous_month(
+            partitions.previous_month(this_month))
+        Vote.objects.create(question=question, choice=choice,
+                            timestamp=old_month)
+        partitions.create_vote_partitions(
+            connection, partitions.next_month(this_month))
+        with connection.cursor() as cursor:
+            # moves the vote out of the default partition
+            partitions.create_partition(cursor, old_month)
+            self.assertIn(partitions.next_month(this_month),
+                          partitions.vote_partitions(cursor))
+
+        detached = partitions.detach_vote_partitions(connection, this_month)
+        self.assertIn(partitions.partition_name(old_month), detached)
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(
+            ArchivedVoteCount.objects.get(choice=choice).vote_count, 1)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'requires PostgreSQL')
+class VotePartitionMigrationTests(TransactionTestCase):
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('polls', target)])
+
+    def test_reversible_after_detach(self):
+        question = create_question(question_text='Old.', days=-1)
+        choice = Choice.objects.create(question=question, choice_text='A')
+        this_month = partitions.month_start(timezone.now())
+        old_month = partitions.previous_month(this_month)
+        Vote.objects.create(question=question, choice=choice,
+                            timestamp=old_month)
+        Vote.objects.create(question=question, choice=choice)
+        with connection.cursor() as cursor:
+            partitions.create_partition(cursor, old_month)
+        partitions.create_vote_partitions(
+            connection, partitions.next_month(this_month))
+        detached = partitions.partition_name(old_month)
+        partitions.detach_vote_partitions(connection, this_month)
+
+        latest = MigrationLoader(connection).graph.leaf_nodes('polls')[0][1]
+        self.migrate('0025_archivedvotecount_vote_timestamp_idx')
+        try:
+            with connection.cursor() as cursor:
+                self.assertFalse(partitions.is_partitioned(cursor))
+                self.assertEqual(partitions.detached_vote_partitions(cursor),
+                                 [detached])
+            self.assertEqual(Vote.objects.count(), 1)
+        finally:
+            self.migrate(latest)
+        with connection.cursor() as cursor:
+            self.assertTrue(partitions.is_partitioned(cursor))
+            cursor.execute('DROP TABLE %s' % detached)
+        Vote.objects.create(question=question, choice=choice)
+        self.assertEqual(Vote.objects.count(), 2)
+
+
+class VoteArchiveTests(TestCase):
+    def setUp(self):
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        archive_settings = override_settings(
+            VOTE_ARCHIVE_DIR=Path(archive_dir.name))
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+
+        self.question = create_question(question_text='Closed.', days=-2)
+        self.question.allow_custom = True
+        self.question.min_selection = 0
+        self.question.vote_end = timezone.now()
+        self.question.save()
+        self.choices = [
+            Choice.objects.create(question=self.question, choice_text=text)
+            for text in ('A', 'B')]
+
+    def test_export_and_read_back(self):
+        hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        services.apply_votes([
+            Vote(question=self.question, choice=self.choices[0],
+                 timestamp=hour),
+            Vote(question=self.question, choice=self.choices[0],
+                 timestamp=hour),
+            Vote(question=self.question, choice=self.choices[1],
+                 timestamp=hour - datetime.timedelta(hours=1)),
+            Vote(question=self.question, is_custom=True,
+                 custom_choice_text='C', timestamp=hour)])
+        # neither exported nor kept
+        Vote.objects.create(question=self.question, choice=self.choices[1],
+                            timestamp=hour).delete()
+        self.assertTrue(Vote.all_objects.filter(deleted__isnull=False))
+
+        out = StringIO()
+        call_command('export_votes', name='closed', delete=True, stdout=out,
+                     chunk_size=3)
+        self.assertIn('Exported 4 vote(s) to closed.', out.getvalue())
+        self.assertFalse(Vote.all_objects.exists())
+
+        with self.assertNumQueries(0):
+            [vote_archive] = archive.archives()
+            self.assertEqual(vote_archive.count, 4)
+            self.assertEqual(vote_archive.vote_counts(self.question.pk), {
+                self.choices[0].pk: 2, self.choices[1].pk: 1})
+            self.assertEqual(
+                vote_archive.custom_choice_counts(self.question.pk), {'C': 1})
+            self.assertEqual(vote_archive.histogram(self.question.pk), [
+                (hour - datetime.timedelta(hours=1), self.choices[1].pk, 1),
+                (hour, None, 1),
+                (hour, self.choices[0].pk, 2)])
+
+        # exported votes still count towards the counters
+        call_command('reconcile_votes', workers=1, stdout=out)
+        self.assertIn('Corrected 0 counter(s).', out.getvalue())
+
+
+class LatestQuestionsCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_until_edit(self):
+        past = create_question(question_text='Past.', days=-1)
+        future = create_question(question_text='Future.', days=1)
+        self.assertEqual(caching.latest_questions(), [past])
+        with self.assertNumQueries(0):
+            self.assertEqual(caching.latest_questions(), [past])
+
+        future.pub_date = timezone.now()
+        future.save()
+        self.assertEqual(caching.latest_questions(), [future, past])
+
+    @override_settings(POLLS_PAGE_CACHE_TIMEOUT=7 * 86400)
+    def test_expires_at_next_pub_date(self):
+        create_question(question_text='Future.', days=1)
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            caching.latest_questions()
+        _, _, timeout = cache_set.call_args.args
+        self.assertAlmostEqual(timeout, 86400, delta=60)
+
+    @override_settings(POLLS_PAGE_CACHE_TIMEOUT=600)
+    def test_expiry_is_bounded(self):
+        # workers not sharing the cache never see the invalidation
+        create_question(question_text='Past.', days=-1)
+        create_question(question_text='Future.', days=1)
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            caching.latest_questions()
+        self.assertEqual(cache_set.call_args.args[2], 600)
+        cache.clear()
+        Question.objects.filter(pub_date__gt=timezone.now()).delete()
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            caching.latest_questions()
+        self.assertEqual(cache_set.call_args.args[2], 600)
+
+
+class PageQueryBudgetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text='Budget.', days=-1)
+
+    def add_choices_and_attachments(self, count):
+        for i in range(count):
+            Choice.objects.create(question=self.question,
+                                  choice_text='Choice %s' % i)
+            Attachment.objects.create(question=self.question,
+                                      file='attachment%s.txt' % i)
+
+    def test_question_page(self):
+        url = reverse('app_polls:question', args=(self.question.pk,))
+        # ETag stamp, question, choices and attachments
+        for count in (1, 5):
+            self.add_choices_and_attachments(count)
+            with self.assertNumQueries(4):
+                response = self.client.get(url)
+            self.assertContains(response, 'attachment0.txt')
+
+    def test_results_page(self):
+        self.add_choices_and_attachments(3)
+        url = reverse('app_polls:results', args=(self.question.pk,))
+        # ETag stamp, question, then choices and custom choices on a miss
+        with self.assertNumQueries(4):
+            self.client.get(url)
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+
+@override_settings(POLLS_PAGE_CACHE=True)
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text='Cached?', days=-1)
+        self.choice = Choice.objects.create(question=self.question,
+                                            choice_text='Yes')
+        self.url = reverse('app_polls:question', args=(self.question.pk,))
+
+    def test_cached_page_skips_rendering(self):
+        response = self.client.get(self.url)
+        self.assertIsNotNone(response.context)
+        # only the ETag stamp
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertIsNone(response.context)
+        self.assertContains(response, 'Cached?')
+
+    def test_placeholders_are_filled_per_request(self):
+        client = Client(enforce_csrf_checks=True)
+        client.get(self.url)
+        response = client.get(self.url)
+        self.assertIsNone(response.context)
+        content = response.content.decode()
+        self.assertNotIn(caching.CSRF_TOKEN_PLACEHOLDER, content)
+        self.assertNotIn(caching.IDEMPOTENCY_KEY_PLACEHOLDER, content)
+        key = response['ETag'].strip('"').partition('-')[2]
+        self.assertIn('value="%s"' % key, content)
+
+        token = re.search(r'name="csrfmiddlewaretoken" value="(\w+)"',
+                          content)[1]
+        response = client.post(
+            reverse('app_polls:vote', args=(self.question.pk,)),
+            {'csrfmiddlewaretoken': token, 'choice': self.choice.pk,
+             'idempotency_key': key})
+        self.assertEqual(response.status_code, 302)
+
+    def test_vote_invalidates_page(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('app_polls:vote', args=(self.question.pk,)),
+                {'choice': self.choice.pk})
+        response = self.client.get(self.url)
+        self.assertIsNotNone(response.context)
+
+    def test_edit_invalidates_page(self):
+        self.client.get(self.url)
+        self.choice.choice_text = 'Sure'
+        self.choice.save()
+        response = self.client.get(self.url)
+        self.assertIsNotNone(response.context)
+        self.assertContains(response, 'Sure')
+
+    def test_authenticated_users_are_not_cached(self):
+        user = User.objects.create_user('voter')
+        self.client.force_login(user)
+        self.client.get(self.url)
+        response = self.client.get(self.url)
+        self.assertIsNotNone(response.context)
+
+
+def image_file(name, width, height, mode='RGB'):
+    content = BytesIO()
+    Image.new(mode, (width, height)).save(content, 'PNG')
+    return ContentFile(content.getvalue(), name=name)
+
+
+@override_settings(POLLS_THUMBNAIL_WORKERS=0,
+                   POLLS_THUMBNAIL_WIDTHS=[48, 96, 144])
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.question = create_question(question_text='Pictured?', days=-1)
+
+    def set_thumbnail(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.question.thumbnail = image
+            self.question.save()
+        self.question.refresh_from_db()
+
+    def test_variants_are_rendered_after_upload(self):
+        self.set_thumbnail(image_file('photo.png', 120, 60, 'RGBA'))
+        variants = self.question.thumbnail_variants
+        self.assertEqual(variants['name'], 'photo.png')
+        self.assertEqual(variants['width'], 120)
+        self.assertEqual(list(variants['widths']), ['48', '96'])
+        with default_storage.open(variants['widths']['48']) as file:
+            image = Image.open(file)
+            self.assertEqual((image.format, image.size), ('WEBP', (48, 24)))
+
+        srcset = self.question.thumbnail_srcset()
+        self.assertEqual(srcset, '/media/photo-48w.webp 48w, '
+                                 '/media/photo-96w.webp 96w, '
+                                 '/media/photo.png 120w')
+        response = self.client.get(
+            reverse('app_polls:question', args=(self.question.pk,)))
+        self.assertContains(response, "srcset='%s'" % srcset)
+
+    def test_variants_change_the_page_etag(self):
+        url = reverse('app_polls:question', args=(self.question.pk,))
+        self.question.thumbnail = image_file('photo.png', 120, 60)
+        self.question.save()
+        # the ETag depends on the CSRF cookie set by the first response
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        thumbnails.render_variants(self.question.pk, 'photo.png')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'srcset')
+
+    def test_original_is_served_until_variants_exist(self):
+        self.question.thumbnail = image_file('photo.png', 120, 60)
+        self.question.save()
+        self.assertEqual(self.question.thumbnail_srcset(), '')
+        response = self.client.get(
+            reverse('app_polls:question', args=(self.question.pk,)))
+        self.assertContains(response, "src='/media/photo.png'")
+        self.assertNotContains(response, 'srcset')
+
+    def test_undecodable_thumbnail_is_logged(self):
+        with self.assertLogs('polls.thumbnails', 'ERROR'):
+            self.set_thumbnail(ContentFile(b'not an image', name='bad.png'))
+        self.assertEqual(self.question.thumbnail_variants, {})
+        self.assertEqual(self.question.thumbnail_srcset(), '')
+
+    @override_settings(POLLS_THUMBNAIL_WORKERS=1)
+    def test_failed_worker_render_is_logged(self):
+        future = Future()
+        future.set_exception(OSError('cannot identify image file'))
+        pool = mock.Mock(**{'submit.return_value': future})
+        with mock.patch.object(thumbnails, 'get_pool', return_value=pool), \
+                self.assertLogs('polls.thumbnails', 'ERROR'):
+            self.set_thumbnail(image_file('photo.png', 120, 60))
+        self.assertEqual(self.question.thumbnail_variants, {})
+
+    def test_replaced_thumbnail_keeps_new_variants(self):
+        self.set_thumbnail(image_file('old.png', 120, 60))
+        self.set_thumbnail(image_file('new.png', 60, 60))
+        # a late render of the replaced thumbnail is discarded
+        thumbnails.render_variants(self.question.pk, 'old.png')
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.thumbnail_variants['name'], 'new.png')
+        self.assertEqual(self.question.thumbnail_srcset(),
+                         '/media/new-48w.webp 48w, /media/new.png 60w')
+
+
+class SigningStorage(URLCacheMixin, FileSystemStorage):
+    """Local stand-in for a storage serving presigned URLs."""
+    querystring_auth = True
+    querystring_expire = 600
+
+
+@override_settings(FILE_URL_CACHE_MARGIN=60)
+class URLCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.storage = SigningStorage(base_url='/media/')
+        url = mock.patch.object(FileSystemStorage, 'url', autospec=True,
+                                side_effect=FileSystemStorage.url)
+        self.sign = url.start()
+        self.addCleanup(url.stop)
+
+    def test_urls_are_signed_once(self):
+        self.assertEqual(self.storage.url('a.pdf'), '/media/a.pdf')
+        self.assertEqual(self.storage.url('a.pdf'), '/media/a.pdf')
+        self.assertEqual(self.sign.call_count, 1)
+
+    def test_urls_expire_before_signatures(self):
+        with mock.patch.object(cache, 'set_many',
+                               wraps=cache.set_many) as set_many:
+            self.storage.url('a.pdf')
+        self.assertEqual(set_many.call_args.args[1], 540)
+
+    def test_bulk_urls(self):
+        self.storage.url('b.pdf')
+        with mock.patch.object(cache, 'get_many',
+                               wraps=cache.get_many) as get_many:
+            urls = self.storage.urls(['a.pdf', 'b.pdf', 'c d.pdf'])
+        self.assertEqual(urls, {'a.pdf': '/media/a.pdf',
+                                'b.pdf': '/media/b.pdf',
+                                'c d.pdf': '/media/c%20d.pdf'})
+        self.assertEqual(get_many.call_count, 1)
+        self.assertEqual(self.sign.call_count, 3)
+
+    def test_delete_forgets_url(self):
+        self.storage.url('a.pdf')
+        with mock.patch.object(FileSystemStorage, 'delete'):
+            self.storage.delete('a.pdf')
+        self.storage.url('a.pdf')
+        self.assertEqual(self.sign.call_count, 2)
+
+
+@override_settings(FILE_DOWNLOAD_CHUNK_SIZE=4, FILE_DOWNLOAD_SENDFILE='')
+class DownloadTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.question = create_question(question_text='Attached.', days=-1)
+        self.attachment = Attachment.objects.create(
+            question=self.question,
+            file=ContentFile(b'0123456789', name='digits.txt'))
+        self.url = reverse('app_polls:attachment', args=(self.attachment.pk,))
+
+    def test_whole_file_is_streamed(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(list(response.streaming_content),
+                         [b'0123', b'4567', b'89'])
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertEqual(response['Content-Disposition'],
+                         'inline; filename="digits.txt"')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_ranges(self):
+        for header, content, content_range in [
+                ('bytes=2-5', b'2345', 'bytes 2-5/10'),
+                ('bytes=7-', b'789', 'bytes 7-9/10'),
+                ('bytes=-3', b'789', 'bytes 7-9/10'),
+                ('bytes=8-20', b'89', 'bytes 8-9/10')]:
+            response = self.client.get(self.url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(b''.join(response.streaming_content), content)
+            self.assertEqual(response['Content-Range'], content_range)
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+        # multiple ranges are answered with the whole file
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-1,4-5')
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_range(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5',
+                                   HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5',
+                                   HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(FILE_DOWNLOAD_SENDFILE='x-accel-redirect',
+                       FILE_DOWNLOAD_ACCEL_PREFIX='/protected/')
+    def test_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/digits.txt')
+        self.assertEqual(response.content, b'')
+
+    def test_unpublished_question(self):
+        self.question.pub_date = timezone.now() + datetime.timedelta(days=1)
+        self.question.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        response = self.client.get(
+            reverse('app_polls:thumbnail', args=(self.question.pk,)))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(DIRECT_UPLOAD_PART_SIZE=4, DIRECT_UPLOAD_MAX_SIZE=100)
+class DirectUploadTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(
+            MEDIA_ROOT=media_root.name,
+            DEFAULT_FILE_STORAGE='polls.storage.FileSystemUploadStorage')
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def send(self, target, content):
+        response = self.client.generic(target['method'], target['url'],
+                                       content, **target['headers'])
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_upload(self):
+        upload = uploads.start_upload(default_storage, '../a b.txt', 3,
+                                      'text/plain')
+        self.send(upload['target'], b'abc')
+        name = uploads.uploaded_name(default_storage, upload['token'])
+        self.assertRegex(name, r'^uploads/\w{32}/a_b.txt$')
+        with default_storage.open(name) as file:
+            self.assertEqual(file.read(), b'abc')
+
+    def test_multipart_upload(self):
+        upload = uploads.start_upload(default_storage, 'digits.txt', 10,
+                                      'text/plain')
+        self.assertEqual(len(upload['parts']), 3)
+        # parts may arrive in any order
+        etags = [None] * 3
+        for part in (2, 0, 1):
+            etags[part] = self.send(upload['parts'][part],
+                                    b'0123456789'[part * 4:part * 4 + 4])
+        uploads.complete_upload(default_storage, upload['token'], etags)
+        name = uploads.uploaded_name(default_storage, upload['token'])
+        with default_storage.open(name) as file:
+            self.assertEqual(file.read(), b'0123456789')
+        self.assertEqual(default_storage.listdir(os.path.dirname(name)),
+                         ([], ['digits.txt']))
+
+    def test_invalid_uploads(self):
+        with self.assertRaises(ValidationError):
+            uploads.start_upload(default_storage, 'big.bin', 101, '')
+        upload = uploads.start_upload(default_storage, 'a.txt', 3, '')
+        # not uploaded yet
+        with self.assertRaises(ValidationError):
+            uploads.uploaded_name(default_storage, upload['token'])
+        with self.assertRaises(ValidationError):
+            uploads.uploaded_name(default_storage, upload['token'] + 'x')
+        self.send(upload['target'], b'abc')
+        with self.assertRaises(ValidationError):
+            uploads.uploaded_name(default_storage, upload['token'], image=True)
+
+        url = upload['target']['url'].replace('/uploads/', '/uploads/x')
+        response = self.client.put(url, b'abc')
+        self.assertEqual(response.status_code, 403)
+
+    def test_long_filename(self):
+        upload = uploads.start_upload(default_storage, 'a' * 120 + '.txt', 3,
+                                      'text/plain')
+        self.send(upload['target'], b'abc')
+        name = uploads.uploaded_name(default_storage, upload['token'])
+        self.assertEqual(len(name), uploads.UPLOAD_NAME_MAX_LENGTH)
+        self.assertTrue(name.endswith('aaa.txt'))
+
+    def test_oversized_upload(self):
+        upload = uploads.start_upload(default_storage, 'a.txt', 3, '')
+        target = upload['target']
+        response = self.client.generic(target['method'], target['url'],
+                                       b'x' * 101, **target['headers'])
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(default_storage.exists(
+            uploads.load_token(upload['token'])['name']))
+
+        upload = uploads.start_upload(default_storage, 'digits.txt', 10, '')
+        target = upload['parts'][0]
+        response = self.client.generic(target['method'], target['url'],
+                                       b'01234', **target['headers'])
+        self.assertEqual(response.status_code, 413)
+
+
+class OverwritingStorage(ContentAddressedMixin, FileSystemStorage):
+    # like S3Storage with AWS_S3_FILE_OVERWRITE
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            os.remove(self.path(name))
+        return super()._save(name, content)
+
+
+class ContentAddressedTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(
+            MEDIA_ROOT=media_root.name,
+            DEFAULT_FILE_STORAGE=(
+                'polls.storage.ContentAddressedFileSystemStorage'))
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.question = create_question('Question', days=-1)
+
+    def attach(self, content, name='a.txt'):
+        attachment = Attachment(question=self.question)
+        attachment.file.save(name, ContentFile(content, name))
+        return attachment
+
+    def sweep(self, grace_hours=0):
+        out = StringIO()
+        call_command('sweep_blobs', grace_hours=grace_hours, stdout=out)
+        return out.getvalue()
+
+    def test_same_content_stored_once(self):
+        first = self.attach(b'abc')
+        second = self.attach(b'abc', 'b.txt')
+        self.attach(b'def')
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertTrue(first.file.name.startswith('blobs/'))
+        blob = Blob.objects.get(name=first.file.name)
+        self.assertEqual((blob.ref_count, blob.size), (2, 3))
+        self.assertEqual(Blob.objects.count(), 2)
+        with second.file.open() as file:
+            self.assertEqual(file.read(), b'abc')
+
+        # shared with the other attachment
+        first.file.delete()
+        self.assertTrue(default_storage.exists(second.file.name))
+
+    def test_attachments_keep_their_names(self):
+        self.attach(b'abc')
+        second = self.attach(b'abc', 'b.txt')
+        second.refresh_from_db()
+        self.assertEqual(second.filename, 'b.txt')
+        response = self.client.get(
+            reverse('app_polls:attachment', args=(second.pk,)))
+        self.assertEqual(response['Content-Disposition'],
+                         'inline; filename="b.txt"')
+        response = self.client.get(
+            reverse('app_polls:question', args=(self.question.pk,)))
+        self.assertContains(response, 'b.txt')
+
+    def test_concurrent_save_keeps_shared_blob(self):
+        storage = OverwritingStorage()
+        sha256 = storage.hash_content(ContentFile(b'abc'))
+        write = storage._save
+
+        def write_concurrently(name, content):
+            # another save of the content commits its blob while this one
+            # is writing
+            Blob.objects.create(sha256=sha256, size=3, ref_count=1,
+                                name=write(name, ContentFile(b'abc')))
+            return write(name, content)
+
+        with mock.patch.object(storage, '_save',
+                               side_effect=write_concurrently):
+            name = storage.save('a.txt', ContentFile(b'abc'))
+        self.assertEqual(name, Blob.objects.get().name)
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+    def test_uploads_hashed_while_received(self):
+        handler = uploads.HashingMemoryFileUploadHandler()
+        handler.handle_raw_input(None, {}, 3, 'boundary')
+        with self.assertRaises(StopFutureHandlers):
+            handler.new_file('file', 'a.txt', 'text/plain', 3)
+        handler.receive_data_chunk(b'abc', 0)
+        file = handler.file_complete(3)
+        self.assertEqual(
+            file.sha256,
+            'ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad')
+        with mock.patch.object(ContentAddressedMixin,
+                               'hash_content') as hash_content:
+            name = default_storage.save('a.txt', file)
+        hash_content.assert_not_called()
+        self.assertEqual(Blob.objects.get().name, name)
+
+    def test_sweep(self):
+        kept = self.attach(b'abc')
+        removed = self.attach(b'def')
+        Attachment.objects.filter(pk=removed.pk).delete()
+        # thumbnails of deleted questions are still referred to
+        self.question.thumbnail.save('t.txt', ContentFile(b'ghi'))
+        self.question.delete()
+
+        self.assertIn('deleted 0 blob(s)', self.sweep(grace_hours=1))
+        self.assertIn('deleted 1 blob(s) of 3', self.sweep())
+        self.assertEqual(
+            sorted(Blob.objects.values_list('name', 'ref_count')),
+            sorted([(kept.file.name, 1), (self.question.thumbnail.name, 1)]))
+        self.assertFalse(default_storage.exists(removed.file.name))
+        self.assertTrue(default_storage.exists(kept.file.name))
+
+        # saved again once swept
+        self.assertTrue(default_storage.exists(self.attach(b'def').file.name))
+
+    @override_settings(
+        DEFAULT_FILE_STORAGE='polls.storage.FileSystemUploadStorage')
+    def test_sweep_requires_content_addressed_storage(self):
+        with self.assertRaises(CommandError):
+            self.sweep()
+
+
+class CollectOrphanedMediaTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = override_settings(
+            MEDIA_ROOT=media_root.name,
+            DEFAULT_FILE_STORAGE='polls.storage.FileSystemUploadStorage')
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def save(self, name, content=b'abc', hours=48):
+        name = default_storage.save(name, ContentFile(content))
+        modified = (timezone.now() - datetime.timedelta(hours=hours))
+        os.utime(default_storage.path(name),
+                 (modified.timestamp(), modified.timestamp()))
+        return name
+
+    def collect(self, *args):
+        out = StringIO()
+        call_command('collect_orphaned_media', *args, batch_size=2,
+                     stdout=out)
+        return out.getvalue()
+
+    def test_collect(self):
+        question = create_question('Question', days=-1)
+        Attachment.objects.create(question=question,
+                                  file=self.save('attached.txt'))
+        question.thumbnail = self.save('thumbnail.png')
+        question.thumbnail_variants = {
+            'name': question.thumbnail.name, 'width': 100,
+            'widths': {'48': self.save('thumbnails/48.webp')}}
+        question.save()
+        # deleted questions are still referred to
+        question.delete()
+        kept = [
+            'attached.txt', 'thumbnail.png', 'thumbnails/48.webp',
+            self.save('recent.txt', hours=1),
+            self.save('uploads/a/recent.txt', hours=20),
+            self.save('blobs/a/orphaned.txt'),
+            self.save('archives/orphaned.txt'),
+        ]
+        orphaned = [
+            self.save('orphaned.txt', b'abcd'),
+            self.save('thumbnails/orphaned.webp'),
+            self.save('uploads/b/orphaned.txt'),
+        ]
+
+        out = self.collect('--skip', 'archives', '--dry-run')
+        self.assertEqual(sorted(out.splitlines()[:-1]), sorted(orphaned))
+        self.assertEqual(out.splitlines()[-1],
+                         'Found 3 orphaned file(s) of 10\xa0bytes.')
+        self.assertTrue(all(map(default_storage.exists, orphaned)))
+
+        self.assertIn('Deleted 3 orphaned file(s)',
+                      self.collect('--skip', 'archives'))
+        self.assertFalse(any(map(default_storage.exists, orphaned)))
+        self.assertTrue(all(map(default_storage.exists, kept)))
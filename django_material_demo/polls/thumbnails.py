@@ -0,0 +1,130 @@
+"""
+Resized, recompressed variants of the question thumbnails.
+
+Variants are rendered after the thumbnail is saved, in a pool of
+`POLLS_THUMBNAIL_WORKERS` worker processes, and recorded in
+`Question.thumbnail_variants`. Pages serve them with `srcset` and fall back
+to the original until they exist.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from . import caching
+from .models import Question
+
+logger = logging.getLogger(__name__)
+
+VARIANT_FORMAT = 'WEBP'
+VARIANT_EXTENSION = 'webp'
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawned, as forking a threaded server process is unsafe;
+            # workers set Django up before loading this module
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.POLLS_THUMBNAIL_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup)
+        return _pool
+
+
+def variant_name(name, width):
+    stem = os.path.splitext(name)[0]
+    return '%s-%sw.%s' % (stem, width, VARIANT_EXTENSION)
+
+
+def resize(image, width):
+    height = max(round(image.height * width / image.width), 1)
+    return image.resize((width, height), Image.Resampling.LANCZOS)
+
+
+def render_variants(question_id, name):
+    """
+    Write the variants of the thumbnail `name` of a question narrower than
+    the original and record them, unless the thumbnail was replaced in the
+    meantime. Returns the recorded variants.
+    """
+    with default_storage.open(name) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert(
+            'RGBA' if image.mode in ('LA', 'PA')
+            or 'transparency' in image.info else 'RGB')
+
+    widths = {}
+    for width in sorted(settings.POLLS_THUMBNAIL_WIDTHS):
+        if width >= image.width:
+            break
+        content = BytesIO()
+        resize(image, width).save(
+            content, VARIANT_FORMAT,
+            quality=settings.POLLS_THUMBNAIL_QUALITY, method=6)
+        widths[width] = default_storage.save(
+            variant_name(name, width), ContentFile(content.getvalue()))
+    variants = {'name': name, 'width': image.width, 'widths': widths}
+    # `update()` skips `auto_now`, the question's ETag depends on `modified`
+    Question.objects.filter(pk=question_id, thumbnail=name).update(
+        thumbnail_variants=variants, modified=timezone.now())
+    return variants
+
+
+def render_variants_in_worker(question_id, name):
+    try:
+        return render_variants(question_id, name)
+    finally:
+        connections.close_all()
+
+
+def variants_rendered(question_id):
+    # the pages showing the thumbnail; `update()` sends no signals
+    caching.bump_results_version([question_id])
+    caching.bump_latest_questions_version()
+
+
+def schedule_variants(question):
+    """Render the variants of `question.thumbnail` once it is committed."""
+    question_id, name = question.pk, question.thumbnail.name
+
+    # a failed render is only logged, the original keeps being served
+    def submit():
+        if not settings.POLLS_THUMBNAIL_WORKERS:
+            try:
+                render_variants(question_id, name)
+            except Exception:
+                logger.exception('Failed to render variants of %s', name)
+            else:
+                variants_rendered(question_id)
+            return
+        future = get_pool().submit(render_variants_in_worker,
+                                   question_id, name)
+
+        def done(future):
+            try:
+                future.result()
+            except Exception:
+                logger.exception('Failed to render variants of %s', name)
+            else:
+                variants_rendered(question_id)
+
+        future.add_done_callback(done)
+
+    transaction.on_commit(submit)
@@ -0,0 +1,152 @@
+"""
+Direct uploads of attachments and thumbnails from the browser to the file
+storage, see `polls.storage.DirectUploadMixin`.
+
+The CMS starts an upload with `start_upload`, the browser sends the file
+or its parts straight to the storage, and the form then submits the
+upload token instead of the file, turned back into the stored file name by
+`uploaded_name`.
+
+Files posted with the forms are hashed as they stream in by the hashing
+upload handlers, for `polls.storage.ContentAddressedMixin`.
+"""
+import hashlib
+import math
+import os
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.core.files.uploadhandler import (MemoryFileUploadHandler,
+                                             TemporaryFileUploadHandler)
+from django.template.defaultfilters import filesizeformat
+from django.utils.text import get_valid_filename
+from PIL import Image, UnidentifiedImageError
+
+from .storage import UPLOAD_PREFIX
+
+TOKEN_SALT = 'polls.uploads'
+# uploaded files are expected in a form submitted within a day
+TOKEN_MAX_AGE = 86400
+# max_length of Attachment.file and Question.thumbnail
+UPLOAD_NAME_MAX_LENGTH = 100
+
+
+def upload_name(filename, max_length=UPLOAD_NAME_MAX_LENGTH):
+    """
+    Return a new unique name for the uploaded `filename`, its root cut short
+    to fit in `max_length` characters.
+    """
+    directory = '%s%s/' % (UPLOAD_PREFIX, uuid.uuid4().hex)
+    basename = get_valid_filename(os.path.basename(filename))
+    available = max_length - len(directory)
+    if len(basename) > available:
+        root, ext = os.path.splitext(basename)
+        ext = ext[:available - 1]
+        basename = root[:available - len(ext)] + ext
+    return directory + basename
+
+
+def start_upload(storage, filename, size, content_type):
+    """
+    Return the upload token and either the target of the whole file, or
+    the part size and targets of a multipart upload.
+    """
+    if size > settings.DIRECT_UPLOAD_MAX_SIZE:
+        raise ValidationError(
+            'Ensure this file is at most %(max)s.', 'file_too_large',
+            params={'max': filesizeformat(settings.DIRECT_UPLOAD_MAX_SIZE)})
+    name = upload_name(filename)
+    part_size = settings.DIRECT_UPLOAD_PART_SIZE
+    if size <= part_size:
+        return {
+            'token': signing.dumps({'name': name}, salt=TOKEN_SALT),
+            'target': storage.upload_target(name, content_type),
+        }
+    upload_id, targets = storage.start_multipart_upload(
+        name, content_type, math.ceil(size / part_size))
+    return {
+        'token': signing.dumps({'name': name, 'upload_id': upload_id},
+                               salt=TOKEN_SALT),
+        'part_size': part_size,
+        'parts': targets,
+    }
+
+
+def load_token(token):
+    try:
+        return signing.loads(token, salt=TOKEN_SALT, max_age=TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        raise ValidationError('The upload has expired, please upload the '
+                              'file again.', 'invalid_upload')
+
+
+def complete_upload(storage, token, etags):
+    """Join the parts of a multipart upload, given their ETags in order."""
+    upload = load_token(token)
+    if 'upload_id' not in upload:
+        raise ValidationError('Not a multipart upload.', 'invalid_upload')
+    storage.complete_multipart_upload(upload['name'], upload['upload_id'],
+                                      etags)
+
+
+def uploaded_name(storage, token, image=False):
+    """
+    Return the name of the file uploaded with `token`, validated like a
+    file posted with the form.
+    """
+    name = load_token(token)['name']
+    if not storage.exists(name):
+        raise ValidationError('The file was not uploaded, please upload it '
+                              'again.', 'invalid_upload')
+    if storage.size(name) > settings.DIRECT_UPLOAD_MAX_SIZE:
+        storage.delete(name)
+        raise ValidationError(
+            'Ensure this file is at most %(max)s.', 'file_too_large',
+            params={'max': filesizeformat(settings.DIRECT_UPLOAD_MAX_SIZE)})
+    if image:
+        # only the header is read
+        try:
+            with storage.open(name) as file:
+                Image.open(file)
+        except UnidentifiedImageError:
+            raise ValidationError(
+                'Upload a valid image. The file you uploaded was either not '
+                'an image or a corrupted image.', 'invalid_image')
+    return name
+
+
+class HashingUploadMixin(object):
+    """
+    Upload handler mixin computing the SHA-256 of the files it receives as
+    they stream in, set as their `sha256`.
+    """
+
+    def new_file(self, *args, **kwargs):
+        # first, as the handler taking the file stops the others
+        self.digest = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        data = super().receive_data_chunk(raw_data, start)
+        if data is None:
+            # kept by this handler rather than passed on to the next one
+            self.digest.update(raw_data)
+        return data
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.digest.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin,
+                                     MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin,
+                                        TemporaryFileUploadHandler):
+    pass
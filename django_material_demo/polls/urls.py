@@ -1,11 +1,23 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import async_views, views
+
+# public pages are served by native async views when running under ASGI
+page_views = async_views if settings.POLLS_ASYNC_VIEWS else views
 
 app_name = 'polls'
 urlpatterns = [
-    path('', views.HomeView.as_view(), name='home'),
-    path('<int:pk>/', views.QuestionView.as_view(), name='question'),
-    path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
-    path('<int:question_id>/vote/', views.vote, name='vote'),
+    path('', page_views.HomeView.as_view(), name='home'),
+    path('<int:pk>/', page_views.QuestionView.as_view(), name='question'),
+    path('<int:pk>/results/', page_views.ResultsView.as_view(),
+         name='results'),
+    path('<int:pk>/results/stream/', views.results_stream,
+         name='results_stream'),
+    path('<int:question_id>/vote/', page_views.vote, name='vote'),
+    path('<int:pk>/thumbnail/', views.thumbnail_download, name='thumbnail'),
+    path('attachments/<int:pk>/', views.attachment_download,
+         name='attachment'),
+    path('uploads/<str:token>/', views.upload, name='upload'),
+    path('votes/', views.batch_vote, name='batch_vote'),
 ]
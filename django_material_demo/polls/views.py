@@ -1,54 +1,308 @@
-from django.http import HttpResponseRedirect
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import RequestDataTooBig, ValidationError
+from django.core.files.storage import default_storage
+from django.http import (Http404, HttpResponse, HttpResponseRedirect,
+                         JsonResponse, StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
-from django.utils import timezone
+from django.utils import timezone, translation
+from django.utils.cache import parse_etags
+from django.utils.decorators import method_decorator
 from django.views import generic
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import (condition, require_http_methods,
+                                          require_POST, require_safe)
+
+from . import caching, downloads, services, streams
+from .models import Attachment, Question
+from .storage import FileSystemUploadStorage
+
+
+def question_context(question, idempotency_key=None):
+    return {
+        'question': question,
+        'choices': question.choice_set.all(),
+        'attachments': question.attachment_set.all(),
+        # lets the vote form be resubmitted without counting twice
+        'idempotency_key': idempotency_key or uuid.uuid4().hex,
+    }
+
+
+def question_stamp(request, queryset, pk):
+    """
+    Return a version stamp of the public pages of a question as seen by
+    `request`, or None if it is not in `queryset`. Costs one query.
+    """
+    question = (services.with_live_total_vote_count(queryset.filter(pk=pk))
+                .values_list('modified', 'live_total_vote_count',
+                             'show_vote', 'vote_end')
+                .first())
+    if question is None:
+        return None
+    modified, total_vote_count, show_vote, vote_end = question
+    parts = [
+        modified.isoformat(),
+        total_vote_count,
+        translation.get_language(),
+        Question(show_vote=show_vote, vote_end=vote_end).can_show_votes(),
+        request.user.pk,
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+    ]
+    return hashlib.md5(repr(parts).encode(),
+                       usedforsecurity=False).hexdigest()
+
+
+def question_etag(request, pk):
+    """
+    ETag of the question page. The page carries a vote idempotency key, so
+    the client's copy is only current while its key is unused; the key to
+    render is left in `request.idempotency_key`.
+    """
+    stamp = question_stamp(
+        request, Question.objects.filter(pub_date__lte=timezone.now()), pk)
+    if stamp is None:
+        return None
+    cached_keys = []
+    for etag in parse_etags(request.headers.get('If-None-Match', '')):
+        etag_stamp, _, key = etag.removeprefix('W/').strip('"').partition('-')
+        if etag_stamp == stamp and key:
+            cached_keys.append(key)
+    request.idempotency_key = next(
+        (key for key in cached_keys
+         if not services.submission_key_used(key)),
+        uuid.uuid4().hex)
+    return '%s-%s' % (stamp, request.idempotency_key)
+
+
+def results_etag(request, pk):
+    return question_stamp(request, Question.objects.all(), pk)
+
 
-from .models import Choice, Question, Vote
+class PageCacheMixin(object):
+    """
+    Serve the page to anonymous users from the cache when `POLLS_PAGE_CACHE`
+    is on. Cached pages hold placeholders for the CSRF token and the vote
+    idempotency key, filled in for each request.
+    """
+    page_cache_key = None
 
+    def get_page_cache_key(self):
+        raise NotImplementedError
 
-class HomeView(generic.ListView):
+    def get_page_cache_timeout(self):
+        return settings.POLLS_PAGE_CACHE_TIMEOUT
+
+    def get(self, request, *args, **kwargs):
+        if not caching.page_cacheable(request):
+            return super().get(request, *args, **kwargs)
+        self.page_cache_key = self.get_page_cache_key()
+        content = cache.get(self.page_cache_key)
+        if content is None:
+            response = super().get(request, *args, **kwargs)
+            response.render()
+            content = response.content
+            if response.status_code == 200:
+                cache.set(self.page_cache_key, content,
+                          self.get_page_cache_timeout())
+        else:
+            response = HttpResponse()
+        response.content = caching.fill_page_placeholders(request, content)
+        return response
+
+    def render_to_response(self, context, **response_kwargs):
+        if self.page_cache_key:
+            context['csrf_token'] = caching.CSRF_TOKEN_PLACEHOLDER
+            if 'idempotency_key' in context:
+                context['idempotency_key'] = (
+                    caching.IDEMPOTENCY_KEY_PLACEHOLDER)
+        return super().render_to_response(context, **response_kwargs)
+
+
+class HomeView(PageCacheMixin, generic.ListView):
     template_name = 'polls/home.html'
     context_object_name = 'latest_question_list'
 
+    def get_page_cache_key(self):
+        return caching.page_key('home', caching.get_version(
+            caching.LATEST_QUESTIONS_VERSION_KEY))
+
+    def get_page_cache_timeout(self):
+        # the page changes with the latest questions
+        timeout = caching.latest_questions_timeout(5)
+        if timeout is None:
+            return settings.POLLS_PAGE_CACHE_TIMEOUT
+        return min(timeout, settings.POLLS_PAGE_CACHE_TIMEOUT)
+
     def get_queryset(self):
         """Return the last five published questions."""
-        return Question.objects.order_by('-pub_date')[:5]
+        return caching.latest_questions(5)
 
 
-class QuestionView(generic.DetailView):
+@method_decorator(condition(etag_func=question_etag), name='get')
+class QuestionView(PageCacheMixin, generic.DetailView):
     model = Question
     template_name = 'polls/question.html'
 
+    def get_page_cache_key(self):
+        pk = self.kwargs['pk']
+        return caching.page_key('question', pk, caching.results_version(pk))
+
     def get_queryset(self):
         """
         Excludes any questions that aren't published yet.
         """
-        return Question.objects.filter(pub_date__lte=timezone.now())
+        return (Question.objects.filter(pub_date__lte=timezone.now())
+                .prefetch_related('choice_set', 'attachment_set'))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(question_context(
+            self.object, getattr(self.request, 'idempotency_key', None)))
+        return context
 
 
-class ResultsView(generic.DetailView):
+@method_decorator(condition(etag_func=results_etag), name='get')
+class ResultsView(PageCacheMixin, generic.DetailView):
     model = Question
     template_name = 'polls/results.html'
 
+    def get_page_cache_key(self):
+        pk = self.kwargs['pk']
+        return caching.page_key('results', pk, caching.results_version(pk))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['results_rows'] = caching.results_rows(self.object)
+        context['stream_results'] = settings.POLLS_ASYNC_VIEWS
+        return context
+
+
+def results_stream(request, pk):
+    """
+    Push changed vote counts of a question as server-sent events. Under
+    ASGI the stream is served by `streams.ResultsStreamRouter` instead;
+    here it is closed after a while to free the worker.
+    """
+    question = get_object_or_404(Question, pk=pk)
+    if question.show_vote == Question.ShowVote.NEVER:
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(streams.event_stream(question),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_safe
+def attachment_download(request, pk):
+    attachment = get_object_or_404(
+        Attachment, pk=pk,
+        question__in=Question.objects.filter(pub_date__lte=timezone.now()))
+    return downloads.file_response(request, attachment.file,
+                                   filename=attachment.filename)
+
+
+@require_safe
+def thumbnail_download(request, pk):
+    question = get_object_or_404(
+        Question.objects.filter(pub_date__lte=timezone.now()), pk=pk)
+    return downloads.file_response(request, question.thumbnail)
+
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+@csrf_exempt
+@require_http_methods(['PUT'])
+def upload(request, token):
+    """
+    Receive a file uploaded directly to a `FileSystemUploadStorage`, the
+    local stand-in for uploading to S3.
+    """
+    if not isinstance(default_storage, FileSystemUploadStorage):
+        raise Http404('Direct uploads go to the file storage.')
+
+    def chunks():
+        while chunk := request.read(UPLOAD_CHUNK_SIZE):
+            yield chunk
+
+    try:
+        etag = default_storage.receive_upload(token, chunks())
+    except signing.BadSignature:
+        return HttpResponse(status=403)
+    except RequestDataTooBig:
+        return HttpResponse(status=413)
+    response = HttpResponse()
+    response['ETag'] = etag
+    return response
+
+
+def read_ballot(request):
+    """
+    Return the `record_ballot` arguments posted by the vote form, raising
+    ValueError for malformed choice ids.
+    """
+    choice_ids = [int(pk) for pk in request.POST.getlist('choice')]
+    return {
+        'choice_ids': choice_ids,
+        'custom_choice_text': request.POST.get('custom_choice', ''),
+        'idempotency_key': (request.headers.get('Idempotency-Key')
+                            or request.POST.get('idempotency_key')),
+    }
+
 
 def vote(request, question_id):
     question = get_object_or_404(Question, pk=question_id)
     try:
-        selected_choice = question.choice_set.get(pk=request.POST['choice'])
-    except (KeyError, Choice.DoesNotExist):
-        # Redisplay the question voting form.
-        return render(request, 'polls/question.html', {
-            'question': question,
-            'error_message': "You didn't select a choice.",
-        })
+        services.record_ballot(question, **read_ballot(request))
+    except ValueError:
+        error_message = "You didn't select a valid choice."
+    except ValidationError as e:
+        error_message = e.messages[0]
     else:
-        selected_choice.vote_count += 1
-        question.total_vote_count += 1
-        selected_choice.save()
-        question.save()
-        Vote.objects.create(question=question, choice=selected_choice)
         # Always return an HttpResponseRedirect after successfully dealing
         # with POST data. This prevents data from being posted twice if a
         # user hits the Back button.
         return HttpResponseRedirect(reverse('app_polls:results', args=(question.id,)))
+    # Redisplay the question voting form.
+    return render(request, 'polls/question.html', {
+        'error_message': error_message,
+        **question_context(question),
+    })
+
+
+MAX_VOTE_BATCH_SIZE = 1000
+
+
+@csrf_exempt
+@require_POST
+def batch_vote(request):
+    """
+    Record votes queued by kiosk and mobile clients.
+
+    Expects a JSON array of `{"question": <id>, "choice": <id>}` objects and
+    answers with a status for each of them, in the same order.
+    """
+    try:
+        items = json.loads(request.body)
+        entries = [(int(item['question']), int(item['choice']))
+                   for item in items]
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse(
+            {'error': 'Expected a JSON array of question and choice ids.'},
+            status=400)
+    if len(entries) > MAX_VOTE_BATCH_SIZE:
+        return JsonResponse(
+            {'error': 'Batches are limited to %s votes.' % MAX_VOTE_BATCH_SIZE},
+            status=400)
+
+    errors = services.record_vote_batch(entries)
+    return JsonResponse({'results': [
+        {'status': 'error', 'error': error} if error else {'status': 'ok'}
+        for error in errors]})